@@ -165,13 +165,10 @@ def main():
     # Output file name:
     outputFile = args.outputFile
 
-    # Retrieve data from the old solr:
-    oldSolr = solr_wrapper.solrWrapper(oldSolrHost, oldSolrPort, solrCore, verbose=False)
-    oldSolrStudy_df = oldSolr.get_study_table()
-
-    # Retrieve data from the new solr:
-    newSolr = solr_wrapper.solrWrapper(newSolrHost, newSolrPort, solrCore, verbose=False)
-    newSolrStudy_df = newSolr.get_study_table()
+    # Retrieve data from the old and the new solr in parallel (the servers are also checked in parallel):
+    oldSolr = solr_wrapper.solrWrapper(oldSolrHost, oldSolrPort, solrCore, verbose=False, lazy=True)
+    newSolr = solr_wrapper.solrWrapper(newSolrHost, newSolrPort, solrCore, verbose=False, lazy=True)
+    oldSolrStudy_df, newSolrStudy_df = solr_wrapper.run_concurrently([oldSolr.get_study_table, newSolr.get_study_table])
 
     # Extract report for absolute values of the release:
     av_report = report_absolute_values(newSolrStudy_df)
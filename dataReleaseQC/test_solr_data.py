@@ -7,6 +7,26 @@ import codecs
 # Loading custom functions:
 from solrWrapper import solr_wrapper
 
+def get_efo_tables(study_df):
+    """
+    Returns the mapped terms (row, uri, label) and the terms retrieved from OLS (row, ols_uri, ols_label) of the
+    studies in long format, one row for each term. The row column is the position of the study in study_df.
+    """
+
+    # The mapped uris and labels are paired by their position in the lists:
+    mappedUri = study_df.mappedUri.reset_index(drop = True).explode()
+    mappedLabel = study_df.mappedLabel.reset_index(drop = True).explode()
+    mapped_df = pd.DataFrame({'row' : mappedUri.index.to_numpy(), 'uri' : mappedUri.to_numpy(), 'label' : mappedLabel.to_numpy()})
+    mapped_df = mapped_df.loc[mapped_df.uri.notna()].reset_index(drop = True)
+
+    # The efoLink values are formatted as label|short form|uri. Studies without a list of links have no OLS terms:
+    efoLink = study_df.efoLink.reset_index(drop = True)
+    efoLink = efoLink.loc[efoLink.map(lambda x: isinstance(x, list))].explode().dropna()
+    efoLinkFields = efoLink.str.split('|')
+    ols_df = pd.DataFrame({'row' : efoLink.index.to_numpy(), 'ols_uri' : efoLinkFields.str[2].to_numpy(), 'ols_label' : efoLinkFields.str[0].to_numpy()})
+
+    return mapped_df, ols_df
+
 def report_missing_EFOs(study_df):
     """
     This function matches the efo terms stored in the database with the efo terms retrieved from the database.
@@ -15,69 +35,38 @@ def report_missing_EFOs(study_df):
     Input: study_df, pandas.DataFrame object extracted from the solr index.
     """
 
-    # Select problematic rows where at least one of the EFO term is missing from the OLS:
-    def filter_rows(row):
-        
-        # If the efoLink field is missing this row is problematic:
-        if not isinstance(row['efoLink'], list):
-            return [(uri, row['mappedLabel'][i]) for i,uri in enumerate(row['mappedUri'])]
-
-        # If any of the stored EFO terms are not within the OLS list, return row:
-        missingUri = []
-        for i, mappedUri in enumerate(row['mappedUri']):
-            found = 0
-            for efoLink in row['efoLink']:
-                if mappedUri == efoLink.split('|')[2]:
-                    found = 1
-            if found == 0:
-                missingUri.append((mappedUri, row['mappedLabel'][i]))
-
-        return missingUri
-
-    # Filtering for studies with missing EFO term:
-    study_df['missingUri'] = study_df.apply(filter_rows, axis = 1)
-    problematicStudies = study_df.loc[study_df['missingUri'].apply(lambda x: len(x)> 0)]
+    mapped_df, ols_df = get_efo_tables(study_df)
+
+    # Mapped terms of a study not found among the OLS terms of the same study:
+    found_df = ols_df[['row', 'ols_uri']].drop_duplicates().rename(columns = {'ols_uri' : 'uri'})
+    missingEfos_df = mapped_df.merge(found_df, on = ['row', 'uri'], how = 'left', indicator = True)
+    missingEfos_df = missingEfos_df.loc[missingEfos_df._merge == 'left_only']
 
     # Report if all looks good:
-    if len(problematicStudies) == 0:
+    if len(missingEfos_df) == 0:
         return None
 
     # If at least one row has problematic EFO terms, we have to generate a report:
-    report = '[Warning] Mapped trait terms of {} studies could not be retrieved from OLS:\n\n'.format(len(problematicStudies))
-    
-    missingEfos = []
-
-    # Iterating over all studies and find if any of the uri-s are missing:
-    for index, row in study_df.loc[study_df.missingUri.apply(lambda x: len(x) >0)].iterrows():
-        title = row['title']
-        accession = row['accessionId']
-        pubmedId = row['pubmedId']
-
-        for missingUri in row['missingUri']:
-            uri = missingUri[0]
-            label = missingUri[1]
-
-            missingEfos.append({
-                'uri' : uri,
-                'label' : label,
-                'title' : title,
-                'pmid' : pubmedId,
-                'accession' : accession
-            })
-    # Generate a nice dataframe from the missing EFOs:
-    missingEfos_df = pd.DataFrame(missingEfos)
-    
-    for URI in missingEfos_df.uri.unique():
+    report = '[Warning] Mapped trait terms of {} studies could not be retrieved from OLS:\n\n'.format(missingEfos_df.row.nunique())
+
+    # Adding study details:
+    missingEfos_df = missingEfos_df.join(study_df[['title', 'accessionId', 'pubmedId']].reset_index(drop = True), on = 'row')
 
-        # Filter for rows:
-        label = missingEfos_df.loc[missingEfos_df.uri == URI].label.iloc[0]
-        report += '{} ({})\n'.format(label, URI)
+    # Accession IDs of each publication for each missing term, the terms are listed in the order they were found:
+    missingEfos_df['label'] = missingEfos_df.groupby('uri').label.transform('first')
+    publications_df = (missingEfos_df
+                       .groupby(['uri', 'pubmedId'], sort = False)
+                       .agg(label = ('label', 'first'), title = ('title', 'first'), accessions = ('accessionId', ', '.join))
+                       .reset_index())
+    publications_df['uriOrder'] = pd.Categorical(publications_df.uri, categories = missingEfos_df.uri.unique()).codes
+    publications_df = publications_df.sort_values('uriOrder', kind = 'mergesort')
+
+    for URI, publications in publications_df.groupby('uri', sort = False):
+        report += '{} ({})\n'.format(publications.label.iloc[0], URI)
 
         # For each publications we write out the accession IDs:
-        for pmid in missingEfos_df.loc[missingEfos_df.uri == URI].pmid.unique():
-            report += '\t* {:.50}... (pmid: {}): {}\n'.format(missingEfos_df.loc[(missingEfos_df.uri == URI) & (missingEfos_df.pmid == pmid)].title.iloc[0],
-                                               pmid,
-                                              ', '.join(missingEfos_df.loc[(missingEfos_df.uri == URI) & (missingEfos_df.pmid == pmid)].accession.tolist()))
+        for publication in publications.itertuples():
+            report += '\t* {:.50}... (pmid: {}): {}\n'.format(publication.title, publication.pubmedId, publication.accessions)
         report += '\n'
     return report
 
@@ -87,53 +76,23 @@ def report_efo_label_mismatch(study_df):
     It reports each cases when the two are not the same (apart from upper/lower case mismatches).
     """
 
-    # Iterating over the mapped terms, get the uri, look it up in the efoLink fields, and if the link matches, 
-    # check the label:
-    def find_unmatching_label(row):
-        
-        unmatchingEfo = []
-        for i, uri in enumerate(row['mappedUri']):
-            label = row['mappedLabel'][i]
-
-            for efoLink in row['efoLink']:
-                olsUri = efoLink.split('|')[2]
-                olsLabel = efoLink.split('|')[0]
-
-                if olsUri == uri and olsLabel.lower() != label.lower():
-                    unmatchingEfo.append({'olsLabel' : olsLabel, 'dbLabel' : label, 'Uri' : uri})
-                    
-        # If there was no problem:
-        return None if unmatchingEfo == '' else unmatchingEfo
+    mapped_df, ols_df = get_efo_tables(study_df)
 
-    def report_label_mismatch(row):
-        return '\n\t\'{}\' instead of \'{}\' ({})'.format(row['dbLabel'], row['olsLabel'],row['Uri'])
+    # Looking up the mapped terms among the OLS terms of the same study, keeping the order of the terms:
+    mapped_df['mappedOrder'] = range(len(mapped_df))
+    ols_df['olsOrder'] = range(len(ols_df))
+    unmatching_df = mapped_df.merge(ols_df, left_on = ['row', 'uri'], right_on = ['row', 'ols_uri'])
+    unmatching_df = unmatching_df.loc[unmatching_df.label.str.lower() != unmatching_df.ols_label.str.lower()]
+    unmatching_df = unmatching_df.sort_values(['mappedOrder', 'olsOrder'])
 
-    unmatchingTest = study_df.loc[~study_df.efoLink.isna()].apply(find_unmatching_label, axis = 1)
-    unmatchingTest = unmatchingTest.loc[unmatchingTest.apply(lambda x: len(x) == 1)]
-
-    if len(unmatchingTest) == 0:
+    if len(unmatching_df) == 0:
         return None
 
-    report = '[Warning] EFO labels are not mathing with OLS labels for {} studies'.format(len(unmatchingTest))
-
-    # Get dataframe out of the mis-matching labels:
-    unmatchingTest_unpacked = []
-    unmatchingTest.apply(lambda x: [unmatchingTest_unpacked.append(y) for y in x ])
-    unmatchingTest_unpacked
-
-    # Generate dataframe:
-    unmatchingTest_df = pd.DataFrame(unmatchingTest_unpacked)
-    unmatchingTest_df.loc[~unmatchingTest_df.duplicated()]
-
-    report_list = unmatchingTest_df.loc[~unmatchingTest_df.duplicated()].apply(report_label_mismatch, axis = 1)
-
-    if len(report_list) == 0:
-        return None
-    else:
-        report = '[Warning] There are {} mapped trait labels from {} studies where the stored label is different from the OLS label:'.format(
-            len(report_list), len(unmatchingTest_df))
-        for row in report_list:
-            report += row
+    report_df = unmatching_df[['label', 'ols_label', 'uri']].drop_duplicates()
+    report = '[Warning] There are {} mapped trait labels from {} studies where the stored label is different from the OLS label:'.format(
+        len(report_df), unmatching_df.row.nunique())
+    for dbLabel, olsLabel, uri in report_df.itertuples(index = False):
+        report += '\n\t\'{}\' instead of \'{}\' ({})'.format(dbLabel, olsLabel, uri)
 
     return report
 
@@ -180,12 +139,11 @@ def main():
 
     solrObject = solr_wrapper.solrWrapper(host=host, port = port, core=core)
 
-    # Get number of documents:
-    docCount = solrObject.get_all_document_count()
+    # Get number of documents, facets and the study table in parallel:
+    docCount, facets, study_df = solr_wrapper.run_concurrently([solrObject.get_all_document_count, solrObject.get_facets, solrObject.get_study_table])
     print('[Info] Number of documents: {}'.format(docCount))
 
-    # Get fatects:
-    facets = solrObject.get_facets()
+    # Print facets:
     print('[Info] Facets in the core:\n\t{}'.format(',\n\t'.join(['{}:{}'.format(key, value) for key, value in facets.items()])))
 
     # Get a number of a single resource:
@@ -193,7 +151,6 @@ def main():
     print('[Info] Number of {} documents in the core: {}'.format(resource, solrObject.get_resource_counts(resource)))
 
     # Get study table:
-    study_df = solrObject.get_study_table()
     print('[Info] Number or rows in the returned study table dataframe: {}'.format(len(study_df)))
 
     # Generate some kind of header:
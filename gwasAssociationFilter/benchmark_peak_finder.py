@@ -0,0 +1,168 @@
+import pandas as pd
+import numpy as np
+import argparse
+import datetime
+import json
+import platform
+import time
+import tracemalloc
+
+from gwasAssociationFilter import peak_finder
+
+# Chromosome sizes (GRCh38, autosomes) used to spread synthetic variants:
+CHROMOSOME_SIZES = {
+    '1': 248956422, '2': 242193529, '3': 198295559, '4': 190214555, '5': 181538259,
+    '6': 170805979, '7': 159345973, '8': 145138636, '9': 138394717, '10': 133797422,
+    '11': 135086622, '12': 133275309, '13': 114364328, '14': 107043718, '15': 101991189,
+    '16': 90338345, '17': 83257441, '18': 80373285, '19': 58617616, '20': 64444167,
+    '21': 46709983, '22': 50818468
+}
+
+# Function to generate a synthetic association table:
+def generate_associations(rows, signals=None, seed=0):
+    """
+    Returns a table with the columns required by the peak finder, p-values stored as text.
+
+    Background variants have uniformly distributed p-values. Around each signal the -log10 p-value
+    decays with the distance from the lead variant, giving clusters of significant variants as in
+    real GWAS. Some close variants share the p-value of the lead, and some signals are strong enough
+    to go below 1e-308. Mantissas are rounded to one decimal, so tied p-values are frequent.
+    """
+    rng = np.random.default_rng(seed)
+    if signals is None:
+        signals = max(1, rows // 5000)
+
+    # Variants are distributed across chromosomes proportionally to their size:
+    sizes = np.array(list(CHROMOSOME_SIZES.values()), dtype=float)
+    chromosomes = rng.choice(list(CHROMOSOME_SIZES.keys()), size=rows, p=sizes / sizes.sum())
+    positions = (rng.random(rows) * sizes[chromosomes.astype(int) - 1]).astype(np.int64) + 1
+
+    # Background -log10 p-values of uniformly distributed p-values:
+    mLog = rng.exponential(1, rows) / np.log(10)
+
+    # Signals are placed on randomly chosen variants, with their neighbourhood following them:
+    leads = rng.choice(rows, size=min(signals, rows), replace=False)
+    strengths = rng.choice([6, 10, 30, 100, 400], size=len(leads), p=[0.4, 0.3, 0.2, 0.08, 0.02]) * (0.5 + rng.random(len(leads)))
+    widths = rng.uniform(10000, 200000, len(leads))
+
+    order = np.lexsort((positions, chromosomes))
+    sorted_chromosomes = chromosomes[order]
+    sorted_positions = positions[order]
+
+    for lead, strength, width in zip(leads, strengths, widths):
+        chromosome_start = np.searchsorted(sorted_chromosomes, chromosomes[lead], side='left')
+        chromosome_end = np.searchsorted(sorted_chromosomes, chromosomes[lead], side='right')
+        chromosome_positions = sorted_positions[chromosome_start:chromosome_end]
+        start = chromosome_start + np.searchsorted(chromosome_positions, positions[lead] - 3 * width, side='left')
+        end = chromosome_start + np.searchsorted(chromosome_positions, positions[lead] + 3 * width, side='right')
+
+        neighbours = order[start:end]
+        distance = np.abs(positions[neighbours] - positions[lead]) / width
+        signal = strength * np.exp(-distance ** 2) * rng.uniform(0.7, 1, len(neighbours))
+
+        # Close variants in perfect LD are reported with the same p-value as the lead:
+        proxies = (distance < 0.1) & (rng.random(len(neighbours)) < 0.3)
+        signal[proxies] = strength
+        mLog[neighbours] = np.maximum(mLog[neighbours], signal)
+        mLog[lead] = max(mLog[lead], strength)
+
+    # Formatting p-values as mantissa and exponent, avoiding the float underflow:
+    exponent = -np.ceil(mLog).astype(np.int64)
+    mantissa = np.round(10 ** (-mLog - exponent), 1)
+    exponent[mantissa >= 10] += 1
+    mantissa[mantissa >= 10] /= 10
+    pvalues = np.char.add(np.char.add(np.char.mod('%.1f', mantissa), 'E'), exponent.astype(str))
+
+    return pd.DataFrame({
+        'rs_id': np.char.add('rs', np.arange(1, rows + 1).astype(str)),
+        'pvalue': pvalues,
+        'chromosome': chromosomes,
+        'bp_location': positions.astype(str),
+    })
+
+# Function to time the peak finder on a table, and measure its peak memory with a second run:
+def benchmark(input_df, window, threshold, engine='sweep', workers=1, repeats=1, memory=True):
+    input_df = input_df.assign(isTopAssociation = '')
+    timings = []
+    for _ in range(repeats):
+        test_df = input_df.copy()
+        start = time.perf_counter()
+        peak_df = peak_finder.find_top_association(test_df, window=window, threshold=np.log10(threshold), engine=engine, workers=workers)
+        timings.append(time.perf_counter() - start)
+
+    result = {
+        'rows': len(input_df),
+        'window': window,
+        'threshold': threshold,
+        'engine': engine,
+        'workers': workers,
+        'seconds': min(timings),
+        'seconds_all': timings,
+        'flags': {flag: int(count) for flag, count in peak_df.isTopAssociation.value_counts().items()},
+    }
+
+    # Memory allocated by the peak calling (numpy and pandas buffers included). tracemalloc only sees the allocations
+    # of this process, so the memory is not measured when the chromosomes are processed by worker processes:
+    if memory and workers > 1:
+        print('[Warning] Peak memory is only measured with one worker, the worker processes are not traced.')
+    elif memory:
+        test_df = input_df.copy()
+        tracemalloc.start()
+        peak_finder.find_top_association(test_df, window=window, threshold=np.log10(threshold), engine=engine, workers=workers)
+        result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return result
+
+def main():
+    # Parsing commandline arguments
+    parser = argparse.ArgumentParser(description='This script benchmarks the peak finder on synthetic association tables.')
+
+    parser.add_argument('-r', '--rows', default=[10000, 1000000, 10000000], nargs='+', help='Number of rows of the synthetic tables.', type = int)
+    parser.add_argument('-w', '--windows', default=[100000, 500000], nargs='+', help='Window sizes.', type = int)
+    parser.add_argument('-t', '--thresholds', default=[1e-5, 5e-8], nargs='+', help='p-value thresholds.', type = float)
+    parser.add_argument('-e', '--engines', default=['sweep'], nargs='+', choices=['sweep', 'pandas'], help='Peak calling engines to benchmark.')
+    parser.add_argument('-n', '--workers', default=1, help='Number of processes used by the peak finder.', type = int)
+    parser.add_argument('--repeats', default=1, help='Number of timed runs for each setting, the fastest is reported.', type = int)
+    parser.add_argument('--no-memory', default=False, help='Skip the peak memory measurement.', action='store_true')
+    parser.add_argument('--seed', default=0, help='Seed of the synthetic data generator.', type = int)
+    parser.add_argument('--saveTables', default=None, help='Folder to save the synthetic tables into (eg. to test the stream mode).')
+    parser.add_argument('-o', '--output', default='peak_finder_benchmark_{}.json'.format(datetime.date.today()), help='Output JSON file.')
+
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        print('[Info] Generating synthetic table with {} rows...'.format(rows))
+        input_df = generate_associations(rows, seed=args.seed)
+
+        if args.saveTables:
+            table_file = '{}/synthetic_associations_{}.tsv'.format(args.saveTables, rows)
+            input_df.to_csv(table_file, sep="\t", index=False)
+            print('[Info] Synthetic table saved to {}'.format(table_file))
+
+        for engine in args.engines:
+            for window in args.windows:
+                for threshold in args.thresholds:
+                    result = benchmark(input_df, window, threshold, engine=engine, workers=args.workers,
+                                       repeats=args.repeats, memory=not args.no_memory)
+                    print('[Info] rows: {}, engine: {}, window: {}, threshold: {}: {:.2f} seconds'.format(
+                        rows, engine, window, threshold, result['seconds']))
+                    results.append(result)
+
+    # Saving results with the environment, so runs on different machines can be told apart:
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.node(),
+        'seed': args.seed,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('[Info] Benchmark results saved to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
 import pandas as pd
+import numpy as np
 import argparse
 import os
 import math
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # we don't want to get warnings. It works.
 pd.options.mode.chained_assignment = None 
@@ -17,8 +20,220 @@ def get_log(pv):
     else:
         return(math.log10(float(pv)))
 
+# Function to calculate log10(x) for a whole column of p-value strings at once:
+def get_log_vector(pvalues):
+    """
+    Vectorized version of get_log, returns a float64 array.
+
+    The strings are split into mantissa and exponent, only the mantissa is turned into float and the
+    exponent is added to its log10, so p-values below 1e-308 keep their rank. A zero mantissa
+    gives 0 as in get_log, missing or unparsable values (eg. NA) give NaN.
+    """
+    if len(pvalues) == 0:
+        return np.empty(0, dtype=float)
+
+    parts = pd.Series(pvalues, dtype=object).str.upper().str.partition('E')
+    mantissa = pd.to_numeric(parts[0], errors='coerce').to_numpy(dtype=float)
+    exponent = pd.to_numeric(parts[2], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mLogPv = np.log10(mantissa) + exponent
+    mLogPv[mantissa == 0] = 0
+    return mLogPv
+
+# Flags used by the sweep engine, in the order of the output labels:
+UNSET, FALSE, REVIEW, TRUE = 0, 1, 2, 3
+LABELS = np.array(['', 'false', 'REQUIRES REVIEW', 'true'], dtype=object)
+
+# Function to flag peaks on a single chromosome with a sorted position sweep:
+def sweep_chromosome(mLogPv, positions, window, threshold):
+    """
+    Returns an array of flags (FALSE/REVIEW/TRUE) for one chromosome.
+
+    Positions are sorted once, so every window lookup is a binary search and the claimed
+    variants are a slice of the sorted order. The decisions are identical to the pandas engine:
+    variants are visited in p-value order, a significant unclaimed variant claims its window,
+    and ties with the same p-value anywhere on the chromosome are flagged for review.
+    """
+    flags = np.full(len(mLogPv), UNSET, dtype=np.int8)
+
+    # Sorting by position for the window lookups:
+    pos_order = np.argsort(positions, kind='mergesort')
+    sorted_pos = positions[pos_order]
+
+    # Missing positions are sorted last, they are never within the window of any variant:
+    located = np.count_nonzero(~np.isnan(positions))
+
+    # Sorting by p-value, with the same sort as the pandas engine so ties are visited in the same order:
+    pv_order = np.argsort(mLogPv, kind='quicksort')
+    sorted_pv = mLogPv[pv_order]
+
+    for rank, index in enumerate(pv_order):
+
+        # Already claimed by a stronger peak or flagged for review:
+        if flags[index] != UNSET:
+            continue
+
+        # Every remaining variant is sub significant (missing values are sorted last):
+        if not sorted_pv[rank] <= threshold:
+            remaining = pv_order[rank:]
+            flags[remaining[flags[remaining] == UNSET]] = FALSE
+            break
+
+        # We have found a top snp! Setting false flag for ALL variants within the window:
+        # A peak without position only claims itself:
+        pos = positions[index]
+        if np.isnan(pos):
+            flags[index] = FALSE
+        else:
+            start = np.searchsorted(sorted_pos[:located], pos - window, side='left')
+            end = np.searchsorted(sorted_pos[:located], pos + window, side='right')
+            flags[pos_order[start:end]] = FALSE
+
+        # If there are multiple variants with the same p-value, request review, othervise it's a true peak:
+        tie_start = np.searchsorted(sorted_pv, sorted_pv[rank], side='left')
+        tie_end = np.searchsorted(sorted_pv, sorted_pv[rank], side='right')
+        if tie_end - tie_start > 1:
+            flags[pv_order[tie_start:tie_end]] = REVIEW
+        else:
+            flags[index] = TRUE
+
+    return flags
+
+# Function to flag peaks on a single chromosome, also returning the elapsed time:
+def timed_sweep(chromosome, mLogPv, positions, window, threshold):
+    start = time.time()
+    flags = sweep_chromosome(mLogPv, positions, window, threshold)
+    return chromosome, flags, time.time() - start
+
+# Function to flag peaks on each chromosome, in parallel if more than one worker is requested:
+def sweep_chromosomes(arrays, window, threshold, workers=1):
+    """
+    arrays: dictionary with chromosomes as keys and (mLogPv, positions) numpy arrays as values.
+    Returns a dictionary with the flags of each chromosome.
+    """
+    # The largest chromosomes are started first:
+    chromosomes = sorted(arrays, key=lambda chromosome: len(arrays[chromosome][0]), reverse=True)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(timed_sweep, chromosome, *arrays[chromosome], window, threshold) for chromosome in chromosomes]
+            results = [future.result() for future in futures]
+    else:
+        results = [timed_sweep(chromosome, *arrays[chromosome], window, threshold) for chromosome in chromosomes]
+
+    flags = {}
+    for chromosome, chromosome_flags, seconds in results:
+        print('[Info] Chromosome {}: {} variants, {} peaks in {:.2f} seconds.'.format(
+            chromosome, len(chromosome_flags), (chromosome_flags == TRUE).sum(), seconds))
+        flags[chromosome] = chromosome_flags
+    return flags
+
 # Function to find and annotate top association:
-def find_top_association(input_df, window=None, threshold=None):
+def find_top_association(input_df, window=None, threshold=None, engine='sweep', workers=1):
+    if engine == 'pandas':
+        return find_top_association_pandas(input_df, window=window, threshold=threshold)
+
+    mLogPv = get_log_vector(input_df.pvalue)
+    positions = input_df.bp_location.astype(float).to_numpy()
+    flags = np.full(len(input_df), UNSET, dtype=np.int8)
+
+    # Row positions of each chromosome:
+    chromosome_rows = input_df.groupby('chromosome', sort=False).indices
+    arrays = {chromosome: (mLogPv[rows], positions[rows]) for chromosome, rows in chromosome_rows.items()}
+
+    # Merging the flags back in the original row order:
+    for chromosome, chromosome_flags in sweep_chromosomes(arrays, window, threshold, workers).items():
+        flags[chromosome_rows[chromosome]] = chromosome_flags
+
+    input_df['isTopAssociation'] = LABELS[flags]
+    return input_df
+
+# Function to read the input table in chunks with lowercase column names:
+def read_chunks(inputFile, chunksize):
+    try:
+        reader = pd.read_csv(inputFile, sep="\t", dtype = str, chunksize = chunksize)
+    except:
+        raise(Exception("[Error] Input file could not be read. Please provide a tab separated table. Exiting."))
+
+    for chunk in reader:
+        chunk.columns = map(str.lower, chunk.columns)
+        check_header(chunk)
+        yield chunk
+
+# Function to find and annotate top associations without loading the whole table:
+def stream_top_association(inputFile, outputFile, window=None, threshold=None, prune=False, chunksize=1000000, workers=1):
+    """
+    The input is read twice in chunks. The first pass keeps only the variants that can become
+    peaks (row number, position and log p-value for each chromosome), the peaks are called on
+    these, then the second pass writes every chunk with the flags. Variants above the threshold
+    are always 'false', so the memory is bounded by the number of significant variants.
+    """
+
+    # Significant variants: rows within the p-value threshold (pruning drops the ones on the threshold):
+    def significant(chunk):
+        mLogPv = get_log_vector(chunk.pvalue)
+        return (mLogPv < threshold) if prune else (mLogPv <= threshold), mLogPv
+
+    # First pass: collecting significant variants for each chromosome:
+    variants = {}
+    offset = 0
+    for chunk in read_chunks(inputFile, chunksize):
+        keep, mLogPv = significant(chunk)
+        rows = np.flatnonzero(keep)
+        positions = chunk.bp_location.to_numpy()[rows].astype(float)
+        mLogPv = mLogPv[rows]
+
+        for chromosome, index in chunk.iloc[rows].groupby('chromosome', sort=False).indices.items():
+            variants.setdefault(chromosome, []).append((rows[index] + offset, positions[index], mLogPv[index]))
+        offset += len(chunk)
+
+    # Calling peaks on each chromosome:
+    chromosome_rows = {}
+    arrays = {}
+    for chromosome, chunks in variants.items():
+        rows, positions, mLogPv = (np.concatenate(x) for x in zip(*chunks))
+        chromosome_rows[chromosome] = rows
+        arrays[chromosome] = (mLogPv, positions)
+    del variants
+
+    flagged_rows = [np.empty(0, dtype=np.int64)]
+    flags = [np.empty(0, dtype=np.int8)]
+    for chromosome, chromosome_flags in sweep_chromosomes(arrays, window, threshold, workers).items():
+        flagged_rows.append(chromosome_rows[chromosome])
+        flags.append(chromosome_flags)
+
+    flagged_rows = np.concatenate(flagged_rows)
+    flags = np.concatenate(flags)
+    order = np.argsort(flagged_rows)
+    flagged_rows, flags = flagged_rows[order], flags[order]
+    print('[Info] {} significant variants out of {} were tested.'.format(len(flagged_rows), offset))
+
+    # Second pass: writing each chunk with the flags:
+    offset = 0
+    header = True
+    for chunk in read_chunks(inputFile, chunksize):
+        labels = np.full(len(chunk), 'false', dtype=object)
+        labels[chunk.chromosome.isna().to_numpy()] = ''
+
+        start, end = np.searchsorted(flagged_rows, [offset, offset + len(chunk)])
+        labels[flagged_rows[start:end] - offset] = LABELS[flags[start:end]]
+        chunk['isTopAssociation'] = labels
+        offset += len(chunk)
+
+        if prune:
+            chunk = chunk.loc[significant(chunk)[0]]
+
+        chunk.to_csv(outputFile, sep="\t", index= False, na_rep = 'NA', mode = 'w' if header else 'a', header = header)
+        header = False
+
+# Function to check if the required columns are in the header:
+def check_header(input_df):
+    if not pd.Series(['rs_id', 'pvalue', 'chromosome', 'bp_location']).isin(input_df.columns).all():
+        raise Exception('[Error] Not all required columns were found in the file header. Required columns: "rs_id", "pvalue", "chromosome", "bp_location"')
+
+# Reference implementation, kept to check the output of the sweep engine:
+def find_top_association_pandas(input_df, window=None, threshold=None):
     for chromosome in input_df.chromosome.unique():
 
         test_df = input_df.loc[input_df.chromosome == chromosome]
@@ -64,6 +279,10 @@ def main():
     parser.add_argument('-w', '--window', default=100000, help='Window size.', type = int)
     parser.add_argument('-t', '--threshold', default=1e-5, help='p-value threshold.', type = float)
     parser.add_argument('-p', '--prune', default=False, help='Prune out sub significant associations from the output.', action='store_true')
+    parser.add_argument('-s', '--stream', default=False, help='Read the input in chunks, only keeping significant associations in memory.', action='store_true')
+    parser.add_argument('-c', '--chunksize', default=1000000, help='Number of rows read at once in stream mode.', type = int)
+    parser.add_argument('-n', '--workers', default=1, help='Number of processes to call peaks on chromosomes in parallel.', type = int)
+    parser.add_argument('-e', '--engine', default='sweep', choices=['sweep', 'pandas'], help='Peak calling engine. The pandas engine is the slow reference implementation.')
 
     args = parser.parse_args()
 
@@ -72,6 +291,10 @@ def main():
     window = args.window
     threshold = math.log10(args.threshold)
     prune = args.prune
+    engine = args.engine
+    stream = args.stream
+    chunksize = args.chunksize
+    workers = args.workers
 
     if not outputFile:
         raise(Exception("[Error] A output file needs to be specified! Exiting."))
@@ -82,6 +305,11 @@ def main():
     else:
         raise(Exception("[Error] A valid input file is required! Exiting."))
 
+    # Full summary statistics files are processed chunk by chunk:
+    if stream:
+        stream_top_association(inputFile, outputFile, window=window, threshold=threshold, prune=prune, chunksize=chunksize, workers=workers)
+        return
+
     # Reading input file into pandas dataframe:
     try:
         input_df = pd.read_csv(inputFile, sep="\t", dtype = str)
@@ -90,16 +318,15 @@ def main():
     
     # Checking header (setting lowercase):
     input_df.columns = map(str.lower, input_df.columns)
-    if not pd.Series(['rs_id', 'pvalue', 'chromosome', 'bp_location']).isin(input_df.columns).all():
-        raise Exception('[Error] Not all required columns were found in the file header. Required columns: "rs_id", "pvalue", "chromosome", "bp_location"')
+    check_header(input_df)
 
     if prune:
-        input_df = input_df[ input_df.mLogPv < threshold ]
+        input_df = input_df.loc[ get_log_vector(input_df.pvalue) < threshold ]
 
     input_df['isTopAssociation'] = ''
 
     # finding peaks for each chromosome
-    peak_df = (find_top_association(input_df=input_df, window=window, threshold=threshold))
+    peak_df = (find_top_association(input_df=input_df, window=window, threshold=threshold, engine=engine, workers=workers))
     # Saving the modified table into a tab separated file:
     peak_df.to_csv(outputFile, sep="\t", index= False, na_rep = 'NA')
 
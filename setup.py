@@ -33,6 +33,8 @@ setup(
                             'test-solr-data = dataReleaseQC.test_solr_data:main',
                             'extract-epmc-tables = epmcXMLTools.extract_epmc_tables:main',
                             'indexer-manager = solrIndexerManager.indexer_manager:main',
+                            'solr-build-stats = solrIndexerManager.solr_build_stats:main',
+                            'local-solr = solrWrapper.local_solr:main',
                             'stats-file-generator = dataReleaseQC.stats_file_generator:main',
                             'data-release-report = dataReleaseQC.data_release_report:main',
                             'ftp-sync = ftpSummaryStatsScript.ftp_sync:main',
@@ -44,6 +46,7 @@ setup(
                             'study-design-sample-info = curationUtils.studySampleReview.check_studydesign_sampleinfo:main',
                             'data-curation-snapshot = curationUtils.data_curation_snapshot:main',
                             'peak-finder = gwasAssociationFilter.peak_finder:main',
+                            'peak-finder-benchmark = gwasAssociationFilter.benchmark_peak_finder:main',
                             'gwas-Rplotter = catalogPlots.r_plotter:main',
                             'sumstats-fetch-table = catalogPlots.SumStats_fetch_table:main',
                             'sumstats-log-parser = log_analysis.parse_sumstats_ftp_logs:main'
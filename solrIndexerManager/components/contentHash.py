@@ -0,0 +1,351 @@
+import os
+import datetime
+import numpy as np
+import pandas as pd
+from gwas_db_connect import DBConnection
+
+
+# Fields feeding the study and association documents. Housekeeping dates are left out on purpose,
+# so studies are only re-indexed if something shown in solr has changed. The mapped genes are not queried:
+# they only change when the variants are remapped, which updates the LAST_MAPPING_DATE of the associations:
+content_sql = {
+    'study' : '''SELECT
+          S.ACCESSION_ID,
+          P.PUBMED_ID,
+          P.TITLE,
+          P.PUBLICATION,
+          P.PUBLICATION_DATE,
+          AU.FULLNAME,
+          S.INITIAL_SAMPLE_SIZE,
+          S.REPLICATE_SAMPLE_SIZE,
+          S.FULL_PVALUE_SET,
+          S.SNP_COUNT,
+          S.QUALIFIER,
+          S.IMPUTED,
+          S.USER_REQUESTED,
+          S.OPEN_TARGETS,
+          HK.CATALOG_PUBLISH_DATE
+        FROM
+          STUDY S,
+          PUBLICATION P,
+          AUTHOR AU,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.PUBLICATION_ID = P.ID
+          AND P.FIRST_AUTHOR_ID = AU.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'reported_trait' : '''SELECT
+          S.ACCESSION_ID,
+          DT.TRAIT
+        FROM
+          STUDY S,
+          STUDY_DISEASE_TRAIT SDT,
+          DISEASE_TRAIT DT,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = SDT.STUDY_ID
+          AND SDT.DISEASE_TRAIT_ID = DT.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'mapped_trait' : '''SELECT
+          S.ACCESSION_ID,
+          ET.TRAIT,
+          ET.URI
+        FROM
+          STUDY S,
+          STUDY_EFO_TRAIT SETR,
+          EFO_TRAIT ET,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = SETR.STUDY_ID
+          AND SETR.EFO_TRAIT_ID = ET.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'association' : '''SELECT
+          S.ACCESSION_ID,
+          A.ID,
+          A.PVALUE_MANTISSA,
+          A.PVALUE_EXPONENT,
+          A.PVALUE_DESCRIPTION,
+          A.RISK_FREQUENCY,
+          A.OR_PER_COPY_NUM,
+          A.BETA_NUM,
+          A.BETA_UNIT,
+          A.BETA_DIRECTION,
+          A.RANGE,
+          A.LAST_MAPPING_DATE
+        FROM
+          STUDY S,
+          ASSOCIATION A,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = A.STUDY_ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'risk_allele' : '''SELECT
+          S.ACCESSION_ID,
+          A.ID AS ASSOCIATION_ID,
+          L.ID AS LOCUS_ID,
+          L.DESCRIPTION,
+          L.HAPLOTYPE_SNP_COUNT,
+          RA.RISK_ALLELE_NAME,
+          RA.RISK_FREQUENCY,
+          RA.GENOME_WIDE,
+          RA.LIMITED_LIST,
+          SNP.RS_ID,
+          SNP.MERGED,
+          SNP.FUNCTIONAL_CLASS
+        FROM
+          STUDY S,
+          ASSOCIATION A,
+          ASSOCIATION_LOCUS AL,
+          LOCUS L,
+          LOCUS_RISK_ALLELE LRA,
+          RISK_ALLELE RA,
+          SINGLE_NUCLEOTIDE_POLYMORPHISM SNP,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = A.STUDY_ID
+          AND A.ID = AL.ASSOCIATION_ID
+          AND AL.LOCUS_ID = L.ID
+          AND L.ID = LRA.LOCUS_ID
+          AND LRA.RISK_ALLELE_ID = RA.ID
+          AND RA.SNP_ID = SNP.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'snp_location' : '''SELECT
+          S.ACCESSION_ID,
+          A.ID AS ASSOCIATION_ID,
+          SNP.RS_ID,
+          LOC.CHROMOSOME_NAME,
+          LOC.CHROMOSOME_POSITION
+        FROM
+          STUDY S,
+          ASSOCIATION A,
+          ASSOCIATION_SNP_VIEW ASV,
+          SINGLE_NUCLEOTIDE_POLYMORPHISM SNP,
+          SNP_LOCATION SL,
+          LOCATION LOC,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = A.STUDY_ID
+          AND A.ID = ASV.ASSOCIATION_ID
+          AND ASV.SNP_ID = SNP.ID
+          AND SNP.ID = SL.SNP_ID
+          AND SL.LOCATION_ID = LOC.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'reported_gene' : '''SELECT
+          S.ACCESSION_ID,
+          A.ID AS ASSOCIATION_ID,
+          AL.LOCUS_ID,
+          G.GENE_NAME
+        FROM
+          STUDY S,
+          ASSOCIATION A,
+          ASSOCIATION_LOCUS AL,
+          AUTHOR_REPORTED_GENE ARG,
+          GENE G,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = A.STUDY_ID
+          AND A.ID = AL.ASSOCIATION_ID
+          AND AL.LOCUS_ID = ARG.LOCUS_ID
+          AND ARG.REPORTED_GENE_ID = G.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'ancestry' : '''SELECT
+          S.ACCESSION_ID,
+          AN.ID AS ANCESTRY_ID,
+          AN.TYPE,
+          AN.NUMBER_OF_INDIVIDUALS,
+          AN.DESCRIPTION
+        FROM
+          STUDY S,
+          ANCESTRY AN,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = AN.STUDY_ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'ancestral_group' : '''SELECT
+          S.ACCESSION_ID,
+          AN.ID AS ANCESTRY_ID,
+          AG.ANCESTRAL_GROUP
+        FROM
+          STUDY S,
+          ANCESTRY AN,
+          ANCESTRY_ANCESTRAL_GROUP AAG,
+          ANCESTRAL_GROUP AG,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = AN.STUDY_ID
+          AND AN.ID = AAG.ANCESTRY_ID
+          AND AAG.ANCESTRAL_GROUP_ID = AG.ID
+          AND HK.IS_PUBLISHED = '1'
+    ''',
+    'ancestry_country' : '''SELECT
+          S.ACCESSION_ID,
+          AN.ID AS ANCESTRY_ID,
+          'origin' AS COUNTRY_TYPE,
+          C.COUNTRY_NAME
+        FROM
+          STUDY S,
+          ANCESTRY AN,
+          ANCESTRY_COUNTRY_OF_ORIGIN ACOO,
+          COUNTRY C,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = AN.STUDY_ID
+          AND AN.ID = ACOO.ANCESTRY_ID
+          AND ACOO.COUNTRY_ID = C.ID
+          AND HK.IS_PUBLISHED = '1'
+        UNION ALL
+        SELECT
+          S.ACCESSION_ID,
+          AN.ID AS ANCESTRY_ID,
+          'recruitment' AS COUNTRY_TYPE,
+          C.COUNTRY_NAME
+        FROM
+          STUDY S,
+          ANCESTRY AN,
+          ANCESTRY_COUNTRY_RECRUITMENT ACOR,
+          COUNTRY C,
+          HOUSEKEEPING HK
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.ID = AN.STUDY_ID
+          AND AN.ID = ACOR.ANCESTRY_ID
+          AND ACOR.COUNTRY_ID = C.ID
+          AND HK.IS_PUBLISHED = '1'
+    '''
+}
+
+
+def get_content_tables(instance):
+    '''
+    Given the database instance, this function returns the tables with the content of the published studies.
+    '''
+
+    connection = DBConnection.gwasCatalogDbConnector(instance)
+    tables = {name : pd.read_sql(sql, connection.connection) for name, sql in content_sql.items()}
+
+    connection.close()
+    return tables
+
+
+# Missing values are hashed as this token, whatever the type of the column:
+NULL_TOKEN = '\x00NULL'
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def format_value(value):
+    '''
+    Formats a single value of an object column the same way as format_column does.
+    '''
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return NULL_TOKEN
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+        return str(int(value))
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return pd.Timestamp(value).strftime(DATE_FORMAT)
+    return str(value)
+
+
+def format_column(column):
+    '''
+    Returns the values of a column as strings that don't depend on the dtype pandas picked for the column:
+    a NULL turns an integer column into float, so integral numbers are formatted without decimals,
+    and missing values are replaced by the same token in every column.
+    '''
+    if pd.api.types.is_float_dtype(column):
+        values = column.to_numpy(dtype=float)
+        integral = np.isfinite(values) & (np.abs(values) < 2 ** 63) & (np.floor(values) == values)
+        strings = values.astype(str).astype(object)
+        strings[integral] = values[integral].astype(np.int64).astype(str)
+        strings[np.isnan(values)] = NULL_TOKEN
+        return pd.Series(strings, index=column.index)
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.strftime(DATE_FORMAT).fillna(NULL_TOKEN)
+    if pd.api.types.is_integer_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return column.astype(str)
+    return column.map(format_value)
+
+
+def hash_rows(table):
+    '''
+    Returns one 64 bit hash for each study (ACCESSION_ID) of the table, that does not depend on the order of the rows.
+    '''
+    if len(table) == 0:
+        return pd.Series([], dtype=np.uint64)
+
+    values = pd.DataFrame({name : format_column(column) for name, column in table.drop(columns='ACCESSION_ID').items()})
+    row_hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+    # The row hashes are summed up for each study (numpy uint64 additions wrap around, no precision is lost):
+    codes, accessions = pd.factorize(table.ACCESSION_ID)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+
+    return pd.Series(np.add.reduceat(row_hashes[order], starts), index=accessions[codes[order][starts]])
+
+
+def get_study_hashes(tables):
+    '''
+    Combines the hashes of the content tables into a table with the pubmed ID and the content hash of each study.
+    '''
+    studies = tables['study'].drop_duplicates('ACCESSION_ID')
+    studies.index = studies.ACCESSION_ID.tolist()
+    # Filling in missing values would turn the hashes into floats, so each column is aligned with a fill value:
+    combined = pd.DataFrame({name : hash_rows(table).reindex(studies.index, fill_value=0).to_numpy()
+                             for name, table in tables.items()})
+
+    study_hashes = studies[['ACCESSION_ID', 'PUBMED_ID']].copy()
+    study_hashes['CONTENT_HASH'] = ['{:016x}'.format(x) for x in pd.util.hash_pandas_object(combined, index=False)]
+    return study_hashes
+
+
+def read_snapshot(snapshot_file):
+    '''
+    Reads the study hashes saved for the previous release, returns None if there's no snapshot.
+    '''
+    if not os.path.isfile(snapshot_file):
+        print('[Warning] Content hash snapshot ({}) does not exist.'.format(snapshot_file))
+        return None
+
+    study_hashes = pd.read_csv(snapshot_file, sep='\t', dtype=str)
+    study_hashes.index = study_hashes.ACCESSION_ID.tolist()
+    print('[Info] Content hashes of {} studies read from {}'.format(len(study_hashes), snapshot_file))
+    return study_hashes
+
+
+def save_snapshot(study_hashes, snapshot_file):
+    study_hashes.to_csv(snapshot_file, sep='\t', index=False)
+    print('[Info] Content hashes of {} studies saved to {}'.format(len(study_hashes), snapshot_file))
+
+
+def get_hash_updates(old_hashes, new_hashes):
+    '''
+    This function returns dictionary with lists of pmids of studies removed/added/updated based on the content hashes.
+    If a changed study was moved to another publication, both pubmed IDs are updated.
+    '''
+    old_hashes = old_hashes.astype(str)
+    new_hashes = new_hashes.astype(str)
+
+    added = new_hashes.index.difference(old_hashes.index, sort=None)
+    removed = old_hashes.index.difference(new_hashes.index, sort=None)
+    common = new_hashes.index.intersection(old_hashes.index, sort=None)
+    changed = common[new_hashes.CONTENT_HASH.loc[common].to_numpy() != old_hashes.CONTENT_HASH.loc[common].to_numpy()]
+
+    pmid_changes = {
+        "added" : new_hashes.PUBMED_ID.loc[added].unique().tolist(),
+        "removed" : old_hashes.PUBMED_ID.loc[removed].unique().tolist(),
+        "updated" : pd.concat([new_hashes.PUBMED_ID.loc[changed], old_hashes.PUBMED_ID.loc[changed]]).unique().tolist()
+    }
+
+    print('\n[Info] Content hash comparison: {} studies added, {} removed, {} changed ({} unchanged).'.format(
+        len(added), len(removed), len(changed), len(common) - len(changed)))
+    for key, pmids in pmid_changes.items():
+        print('[Info] Number of {} publications: {}'.format(key, len(pmids)))
+
+    return(pmid_changes)
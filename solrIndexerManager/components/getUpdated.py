@@ -1,50 +1,124 @@
 import pandas as pd
+import numpy as np
 from gwas_db_connect import DBConnection
 
 
-def get_db_updates(old_table, new_table):
+class ReleaseDiff(object):
+    '''
+    Differences between the study tables of two releases: one row for each added, removed or updated study.
+
+    Columns: CHANGE (added/removed/updated), ACCESSION_ID, PUBMED_ID, OLD_PUBMED_ID, CATALOG_PUBLISH_DATE,
+    NEW_LAST_UPDATE_DATE, OLD_LAST_UPDATE_DATE. Values missing from one of the releases are empty.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def get_studies(self, change):
+        return self.table.loc[self.table.CHANGE == change]
+
+    def get_pmid_changes(self):
+        '''
+        Returns dictionary with lists of pmids of studies removed/added/updated. If an updated study
+        was moved to another publication, both pubmed IDs are listed.
+        '''
+        updated = self.get_studies('updated')
+        return {
+            "added" : self.get_studies('added').PUBMED_ID.unique().tolist(),
+            "removed" : self.get_studies('removed').OLD_PUBMED_ID.unique().tolist(),
+            "updated" : pd.concat([updated.PUBMED_ID, updated.OLD_PUBMED_ID]).unique().tolist()
+        }
+
+    def summary(self):
+        '''
+        Returns the number of changed studies and publications as text.
+        '''
+        pmid_changes = self.get_pmid_changes()
+        report = []
+        for change in pmid_changes:
+            report.append('[Info] {} studies from {} publications were {}.'.format(
+                len(self.get_studies(change)), len(pmid_changes[change]), change))
+        return '\n'.join(report)
+
+    def to_tsv(self, filename):
+        self.table.to_csv(filename, sep='\t', index=False, na_rep='NA', date_format='%Y-%m-%d')
+
+    def to_json(self, filename):
+        self.table.to_json(filename, orient='records', date_format='iso', indent=2)
+
+
+def get_release_diff(old_table, new_table):
+    '''
+    Compares the study tables of the old and new releases (indexed by ACCESSION_ID) and returns a ReleaseDiff.
+    Studies are updated if any of the shared columns (eg. LAST_UPDATE_DATE, PUBMED_ID) have changed.
+    '''
+    new_accessions = new_table.index.to_numpy()
+    old_accessions = old_table.index.to_numpy()
+
+    # Added and removed studies:
+    added = new_table.loc[~np.isin(new_accessions, old_accessions)]
+    removed = old_table.loc[~np.isin(old_accessions, new_accessions)]
+
+    # One join on the accession IDs for the studies in both releases:
+    columns = [column for column in new_table.columns if column in old_table.columns and column != 'ACCESSION_ID']
+    joined = new_table[columns].join(old_table[columns], how='inner', lsuffix='_new', rsuffix='_old')
+    changed = np.zeros(len(joined), dtype=bool)
+    for column in columns:
+        new_values = joined['{}_new'.format(column)]
+        old_values = joined['{}_old'.format(column)]
+        changed |= ~((new_values == old_values) | (new_values.isna() & old_values.isna())).to_numpy()
+    updated = joined.loc[changed]
+
+    # Pubmed IDs are kept as objects, so they don't turn into floats where they are missing:
+    table = pd.concat([
+        pd.DataFrame({
+            'CHANGE' : 'added',
+            'ACCESSION_ID' : added.index,
+            'PUBMED_ID' : added.PUBMED_ID.to_numpy(dtype=object),
+            'CATALOG_PUBLISH_DATE' : added.CATALOG_PUBLISH_DATE.to_numpy(),
+            'NEW_LAST_UPDATE_DATE' : added.LAST_UPDATE_DATE.to_numpy()
+        }),
+        pd.DataFrame({
+            'CHANGE' : 'removed',
+            'ACCESSION_ID' : removed.index,
+            'OLD_PUBMED_ID' : removed.PUBMED_ID.to_numpy(dtype=object),
+            'CATALOG_PUBLISH_DATE' : removed.CATALOG_PUBLISH_DATE.to_numpy(),
+            'OLD_LAST_UPDATE_DATE' : removed.LAST_UPDATE_DATE.to_numpy()
+        }),
+        pd.DataFrame({
+            'CHANGE' : 'updated',
+            'ACCESSION_ID' : updated.index,
+            'PUBMED_ID' : updated.PUBMED_ID_new.to_numpy(dtype=object),
+            'OLD_PUBMED_ID' : updated.PUBMED_ID_old.to_numpy(dtype=object),
+            'CATALOG_PUBLISH_DATE' : updated.CATALOG_PUBLISH_DATE_new.to_numpy(),
+            'NEW_LAST_UPDATE_DATE' : updated.LAST_UPDATE_DATE_new.to_numpy(),
+            'OLD_LAST_UPDATE_DATE' : updated.LAST_UPDATE_DATE_old.to_numpy()
+        })
+    ], ignore_index=True, sort=False)
+
+    columns = ['CHANGE', 'ACCESSION_ID', 'PUBMED_ID', 'OLD_PUBMED_ID', 'CATALOG_PUBLISH_DATE', 'NEW_LAST_UPDATE_DATE', 'OLD_LAST_UPDATE_DATE']
+    return ReleaseDiff(table.reindex(columns=columns))
+
+
+def get_db_updates(old_table, new_table, diff_file = None):
     '''
     This function returns dictionary with lists of pmids of studies removed/added/updated.
+    The changed studies are saved into diff_file if given (.json or tsv).
     '''
+    release_diff = get_release_diff(old_table, new_table)
+    print('\n' + release_diff.summary())
 
-    # This is the list of pubmedID that will be updated:
-    pmid_changes = {
-        "added" : [],
-        "removed" : [],
-        "updated" : []
-    }
-
-    # Determine newly added studies:
-    new_studies = new_table.loc[new_table.index.difference(old_table.index, sort=None)]
-    if len(new_studies) == 0:
-        print('\n[Info] No new study has been added since the last data release')
-    else:
-        print('\n[Info] {} studies from {} publications were newly added:'.format(len(new_studies), len(new_studies.PUBMED_ID.unique())))
-        new_studies.apply(lambda row: print("\t{}, PMID: {}, catalog added date: {}".format(
-            row['ACCESSION_ID'], row['PUBMED_ID'], row['CATALOG_PUBLISH_DATE'])), axis = 1)
-        pmid_changes['added'] += new_studies.PUBMED_ID.unique().tolist()
-
-    # Determine retracted studies:
-    retracted_studies = old_table.loc[old_table.index.difference(new_table.index, sort=None)]
-    if len(retracted_studies) == 0:
-        print('\n[Info] No study has been retracted since the last data release')
-    else:
-        print('\n[Info] {} studies from {} publications were retraced:'.format(len(retracted_studies), len(retracted_studies.PUBMED_ID.unique())))
-        retracted_studies.apply(lambda row: print("\t{}, PMID: {}, catalog added date: {}".format(
-            row['ACCESSION_ID'], row['PUBMED_ID'], row['CATALOG_PUBLISH_DATE'])), axis = 1)
-        pmid_changes['removed'] += retracted_studies.PUBMED_ID.unique().tolist()
-
-    # Determine updated studies:
-    merged = new_table.merge(old_table, how='outer', suffixes=('_x', '_y'))
-    updated = merged.loc[merged.ACCESSION_ID.duplicated()]
-    if len(updated) == 0:
-        print('\n[Info] No study has been updated since the last data release')
-    else:
-        print('\n[Info] {} studies were updated from {} publications.'.format(len(updated), len(updated.PUBMED_ID.unique())))
-        updated.ACCESSION_ID.apply(lambda x: print("\t{} new date: {:%Y %b %d} vs. old date: {:%Y %b %d}".format(x, new_table.loc[x].LAST_UPDATE_DATE, old_table.loc[x].LAST_UPDATE_DATE)))
-        pmid_changes['updated'] += updated.PUBMED_ID.unique().tolist()
-
-    return(pmid_changes)
+    if diff_file:
+        if diff_file.endswith('.json'):
+            release_diff.to_json(diff_file)
+        else:
+            release_diff.to_tsv(diff_file)
+        print('[Info] List of changed studies saved to {}'.format(diff_file))
+
+    return(release_diff.get_pmid_changes())
 
 def get_studies(instance):
     '''
@@ -74,3 +148,78 @@ def get_studies(instance):
     return study_table
 
 
+
+def get_association_counts(instance):
+    '''
+    Given the database instance, this function returns the number of associations of the published studies for each pubmed ID
+    '''
+
+    association_count_sql = '''SELECT
+          P.PUBMED_ID,
+          COUNT(A.ID) AS ASSOCIATION_COUNT
+        FROM
+          STUDY S,
+          PUBLICATION P,
+          HOUSEKEEPING HK,
+          ASSOCIATION A
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.PUBLICATION_ID = P.ID
+          AND A.STUDY_ID = S.ID
+          AND HK.IS_PUBLISHED = '1'
+        GROUP BY P.PUBMED_ID
+    '''
+
+    connection = DBConnection.gwasCatalogDbConnector(instance)
+    association_counts = pd.read_sql(association_count_sql, connection.connection)
+
+    connection.close()
+    return pd.Series(association_counts.ASSOCIATION_COUNT.to_numpy(), index=association_counts.PUBMED_ID.astype(str).tolist())
+
+def get_traits(instance, pmid_list):
+    '''
+    Given the database instance, this function returns the EFO URIs and reported traits of the published studies of the given publications
+    '''
+
+    efo_trait_sql = '''SELECT
+          P.PUBMED_ID,
+          ET.URI
+        FROM
+          STUDY S,
+          PUBLICATION P,
+          HOUSEKEEPING HK,
+          STUDY_EFO_TRAIT SETR,
+          EFO_TRAIT ET
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.PUBLICATION_ID = P.ID
+          AND S.ID = SETR.STUDY_ID
+          AND SETR.EFO_TRAIT_ID = ET.ID
+          AND HK.IS_PUBLISHED = '1'
+    '''
+
+    disease_trait_sql = '''SELECT
+          P.PUBMED_ID,
+          DT.TRAIT
+        FROM
+          STUDY S,
+          PUBLICATION P,
+          HOUSEKEEPING HK,
+          STUDY_DISEASE_TRAIT SDT,
+          DISEASE_TRAIT DT
+        WHERE HK.ID = S.HOUSEKEEPING_ID
+          AND S.PUBLICATION_ID = P.ID
+          AND S.ID = SDT.STUDY_ID
+          AND SDT.DISEASE_TRAIT_ID = DT.ID
+          AND HK.IS_PUBLISHED = '1'
+    '''
+
+    connection = DBConnection.gwasCatalogDbConnector(instance)
+    efo_traits = pd.read_sql(efo_trait_sql, connection.connection)
+    disease_traits = pd.read_sql(disease_trait_sql, connection.connection)
+
+    connection.close()
+
+    # Publications are filtered here, the list can be longer than what an IN clause accepts:
+    pmids = [str(pmid) for pmid in pmid_list]
+    efo_uris = set(efo_traits.loc[efo_traits.PUBMED_ID.astype(str).isin(pmids)].URI.dropna())
+    trait_names = set(disease_traits.loc[disease_traits.PUBMED_ID.astype(str).isin(pmids)].TRAIT.dropna())
+    return efo_uris, trait_names
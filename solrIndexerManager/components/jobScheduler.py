@@ -0,0 +1,70 @@
+import heapq
+import os
+import re
+
+# Number of jobs Nextflow runs at the same time if executor.queueSize is not set (grid executors):
+NEXTFLOW_QUEUE_SIZE = 100
+
+
+def batch_by_size(pmids, batch_size):
+    '''
+    Splits the pubmed IDs into batches of batch_size.
+    '''
+    pmids = list(pmids)
+    return [pmids[i:i + batch_size] for i in range(0, len(pmids), batch_size)]
+
+
+def batch_by_cost(pmids, costs, max_cost):
+    '''
+    Groups the pubmed IDs into batches with a total cost (eg. number of associations) of at most max_cost.
+
+    Publications are added in decreasing order of their costs, a new batch is started when the next one does
+    not fit. Publications more expensive than max_cost get their own batch. Unknown costs are taken as 1.
+    '''
+    pmid_costs = sorted([(costs.get(str(pmid), 1), pmid) for pmid in pmids], key=lambda x: x[0], reverse=True)
+
+    batches = []
+    batch_cost = 0
+    for cost, pmid in pmid_costs:
+        if not batches or batch_cost + cost > max_cost:
+            batches.append([])
+            batch_cost = 0
+        batches[-1].append(pmid)
+        batch_cost += cost
+
+    return batches
+
+
+def order_by_cost(job_pmids, costs):
+    '''
+    Returns the job IDs in decreasing order of their estimated costs (sum of the costs of their pubmed IDs), so the
+    longest jobs are started first. Jobs without pubmed IDs (trait documents) index all traits, they are started first.
+    '''
+    def job_cost(job_id):
+        pmids = job_pmids[job_id]
+        return sum([costs.get(str(pmid), 1) for pmid in pmids]) if pmids else float('inf')
+
+    return sorted(job_pmids, key=job_cost, reverse=True)
+
+
+def estimate_makespan(job_costs, workers):
+    '''
+    Simulates running the jobs in the given order with the given number of parallel workers (each job is started
+    on the first free worker). Returns the time the last job finishes.
+    '''
+    finish_times = [0.0] * max(1, workers)
+    for cost in job_costs:
+        start = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, start + cost)
+    return max(finish_times)
+
+
+def read_queue_size(config_file):
+    '''
+    Returns executor.queueSize set in a Nextflow config file, None if the file or the setting is missing.
+    '''
+    if not os.path.isfile(config_file):
+        return None
+    with open(config_file) as f:
+        settings = re.findall(r'^\s*executor\.queueSize\s*=\s*(\d+)', f.read(), flags=re.MULTILINE)
+    return int(settings[-1]) if settings else None
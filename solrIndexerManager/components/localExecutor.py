@@ -0,0 +1,118 @@
+import collections
+import heapq
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class LocalBackend(object):
+    '''
+    Runs the indexing commands as subprocesses on the local machine.
+    '''
+
+    def run(self, job_id, cmd, log_file):
+        with open(log_file, 'a') as log:
+            return subprocess.run(cmd, shell=True, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+class LsfBackend(object):
+    '''
+    Submits the indexing commands to LSF, bsub -K waits for the job to finish and returns its exit code.
+    '''
+
+    def __init__(self, queue=None, memory=None, job_group=None, job_prefix=None):
+        self.queue = queue
+        self.memory = memory
+        self.job_group = job_group
+        self.job_prefix = job_prefix
+
+    def run(self, job_id, cmd, log_file):
+        bsub = ['bsub', '-K', '-o', log_file, '-J', '{}{}'.format(self.job_prefix if self.job_prefix else '', job_id)]
+        if self.queue:
+            bsub += ['-q', self.queue]
+        if self.memory:
+            bsub += ['-M', str(self.memory), '-R', 'rusage[mem={}]'.format(self.memory)]
+        if self.job_group:
+            bsub += ['-g', self.job_group]
+        return subprocess.run(bsub + [cmd], stdout=subprocess.DEVNULL).returncode
+
+
+backends = {
+    'local' : LocalBackend,
+    'lsf' : LsfBackend
+}
+
+
+def read_checkpoint(checkpoint_file):
+    '''
+    Returns the set of (job ID, command) pairs completed by a previous run.
+    '''
+    if not os.path.isfile(checkpoint_file):
+        return set()
+    with open(checkpoint_file) as f:
+        return set([tuple(line.rstrip('\n').split('\t', 1)) for line in f if '\t' in line])
+
+
+def run_jobs(job_map, backend, log_dir, workers=4, max_attempts=4, backoff=30, checkpoint_file=None):
+    '''
+    Runs the jobs (job ID -> command) with at most workers jobs running at the same time. A failed job is put back into
+    the queue, to be retried not before backoff * 2^(attempt - 1) seconds, so the waiting doesn't hold a worker: other
+    jobs are started in the meantime, and retries that are due are started before the jobs not started yet.
+    Completed jobs are appended to the checkpoint file, and skipped if the same job is in the checkpoint.
+
+    Returns the list of job records (job_id, duration, attempt, status), and the list of failed job IDs. The memory of
+    the jobs is not recorded: the resource usage of a subprocess includes the memory it inherited from this process.
+    '''
+    completed = read_checkpoint(checkpoint_file) if checkpoint_file else set()
+    jobs = [(job_id, cmd) for job_id, cmd in job_map.items() if (job_id, cmd) not in completed]
+    print('[Info] Running {} jobs ({} already completed) with {} workers.'.format(len(jobs), len(job_map) - len(jobs), workers))
+
+    def run_attempt(job_id, cmd):
+        start = time.time()
+        exit_code = backend.run(job_id, cmd, os.path.join(log_dir, '{}.log'.format(job_id)))
+        return exit_code, time.time() - start
+
+    # Jobs not started yet (in the order of the job map), and failed jobs waiting for their retry (not before, index, attempt):
+    queue = collections.deque(range(len(jobs)))
+    retries = []
+    running = {}
+    records = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while queue or retries or running:
+            # Filling the free workers:
+            while len(running) < workers:
+                if retries and retries[0][0] <= time.time():
+                    _, index, attempt = heapq.heappop(retries)
+                elif queue:
+                    index, attempt = queue.popleft(), 1
+                else:
+                    break
+                running[executor.submit(run_attempt, *jobs[index])] = (index, attempt)
+
+            # Waiting for a job to finish, or for the next retry if a worker is free:
+            timeout = max(0, retries[0][0] - time.time()) if retries and len(running) < workers else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index, attempt = running.pop(future)
+                job_id, cmd = jobs[index]
+                exit_code, duration = future.result()
+                if exit_code == 0:
+                    if checkpoint_file:
+                        with open(checkpoint_file, 'a') as f:
+                            f.write('{}\t{}\n'.format(job_id, cmd))
+                    records[index] = {'job_id' : job_id, 'duration' : duration, 'attempt' : attempt, 'status' : 'COMPLETED'}
+                    continue
+
+                print('[Warning] Job {} failed with exit code {} (attempt {} of {}).'.format(job_id, exit_code, attempt, max_attempts))
+                if attempt < max_attempts:
+                    heapq.heappush(retries, (time.time() + backoff * 2 ** (attempt - 1), index, attempt + 1))
+                else:
+                    records[index] = {'job_id' : job_id, 'duration' : duration, 'attempt' : attempt, 'status' : 'FAILED'}
+
+    records = [records[index] for index in sorted(records)]
+    failed = [record['job_id'] for record in records if record['status'] == 'FAILED']
+    print('[Info] {} jobs completed, {} failed.'.format(len(records) - len(failed), len(failed)))
+    return records, failed
@@ -0,0 +1,123 @@
+import csv
+import datetime
+import sqlite3
+import pandas as pd
+
+
+class RuntimeHistory(object):
+    '''
+    SQLite store of the runtimes of the indexing jobs across releases. Each row is one pubmed ID indexed in a run:
+    if a job indexed a batch of pubmed IDs, the runtime of the job is split equally between them, and each of them
+    gets the peak memory of the job (peak memory does not add up).
+    '''
+
+    __schema = '''CREATE TABLE IF NOT EXISTS runtimes (
+        release TEXT,
+        job_id TEXT,
+        pmid TEXT,
+        batch_size INTEGER,
+        duration REAL,
+        memory INTEGER,
+        attempt INTEGER,
+        status TEXT,
+        recorded TEXT
+    )'''
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        with self.connection:
+            self.connection.execute(self.__schema)
+            self.connection.execute('CREATE INDEX IF NOT EXISTS runtimes_pmid ON runtimes (pmid)')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_runtimes(self, release, records):
+        '''
+        Saves the runtimes of a release. Records are dictionaries with job_id, pmids (list), duration (seconds),
+        memory (bytes), attempt and status keys. Returns the number of saved rows.
+        '''
+        recorded = datetime.datetime.now().isoformat()
+        rows = []
+        for record in records:
+            pmids = record['pmids'] if record['pmids'] else [None]
+            memory = record.get('memory')
+            for pmid in pmids:
+                rows.append((release, record['job_id'], None if pmid is None else str(pmid), len(pmids),
+                             record['duration'] / len(pmids), memory,
+                             record.get('attempt', 1), record.get('status', 'COMPLETED'), recorded))
+
+        with self.connection:
+            self.connection.executemany('INSERT INTO runtimes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        print('[Info] {} runtimes of release {} saved to {}'.format(len(rows), release, self.db_file))
+        return len(rows)
+
+    def get_runtimes(self, release = None):
+        if release:
+            return pd.read_sql('SELECT * FROM runtimes WHERE release = ?', self.connection, params=(release,))
+        return pd.read_sql('SELECT * FROM runtimes', self.connection)
+
+    def get_pmid_costs(self):
+        '''
+        Returns the median runtime (seconds) of the completed indexing of each pubmed ID.
+        '''
+        runtimes = pd.read_sql("SELECT pmid, duration FROM runtimes WHERE status = 'COMPLETED' AND pmid IS NOT NULL", self.connection)
+        return runtimes.groupby('pmid').duration.median()
+
+    def get_job_runtimes(self):
+        '''
+        Returns the median runtime (seconds) of the completed jobs without pubmed IDs (trait document jobs).
+        '''
+        runtimes = pd.read_sql("SELECT job_id, duration FROM runtimes WHERE status = 'COMPLETED' AND pmid IS NULL", self.connection)
+        return runtimes.groupby('job_id').duration.median()
+
+    def get_percentiles(self, release = None, percentiles = (50, 90, 95, 99)):
+        durations = self.get_runtimes(release).query("status == 'COMPLETED'").duration
+        return pd.Series([durations.quantile(p / 100) for p in percentiles], index=['p{}'.format(p) for p in percentiles])
+
+    def get_slowest(self, release = None, count = 10):
+        runtimes = self.get_runtimes(release)
+        runtimes = runtimes.loc[(runtimes.status == 'COMPLETED') & runtimes.pmid.notna()]
+        return runtimes.sort_values('duration', ascending=False).head(count)[['release', 'job_id', 'pmid', 'duration', 'memory', 'attempt']]
+
+    def get_trend(self):
+        '''
+        Runtime statistics of each release, in the order they were recorded.
+        '''
+        runtimes = self.get_runtimes()
+        completed = runtimes.loc[runtimes.status == 'COMPLETED']
+        trend = completed.groupby('release').duration.agg(['count', 'sum', 'median', 'max'])
+        trend['p90'] = completed.groupby('release').duration.quantile(0.9)
+        trend['failed'] = runtimes.loc[runtimes.status != 'COMPLETED'].groupby('release').size()
+        trend['recorded'] = runtimes.groupby('release').recorded.min()
+        return trend.fillna({'failed' : 0}).sort_values('recorded')
+
+
+def read_trace(trace_file, job_pmids = None):
+    '''
+    Reads the runtimes from a Nextflow trace file with raw values (durations in ms, memory in bytes).
+    Tasks taken from the cache of a resumed run are skipped. job_pmids maps the job IDs (task tags) to the indexed pubmed IDs.
+    '''
+    job_pmids = job_pmids if job_pmids else {}
+    records = []
+    with open(trace_file) as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            if row['status'] == 'CACHED':
+                continue
+            records.append({
+                'job_id' : row['tag'],
+                'pmids' : job_pmids.get(row['tag'], []),
+                'duration' : float(row['realtime']) / 1000 if row['realtime'] not in ('', '-') else 0.0,
+                'memory' : int(row['peak_rss']) if row['peak_rss'] not in ('', '-') else None,
+                'attempt' : int(row['attempt']) if row['attempt'] not in ('', '-') else 1,
+                'status' : row['status']
+            })
+    return records
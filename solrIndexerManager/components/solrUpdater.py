@@ -1,26 +1,39 @@
 from solrWrapper import solr_wrapper
 
 
-def removeUpdatedSolrData(solr_object, updated_pmids):
-
-    # Removing all all trait documents:
-    remove_trait_docs(solr_object)
+def removeUpdatedSolrData(solr_object, updated_pmids, chunk_size = 500, report_counts = False, trait_queries = None):
+    '''
+    All delete queries are collected and sent to solr in a single update request with one commit.
+    Document counts before and after the deletion are only queried if report_counts is set.
+    If trait_queries are given, only the matching trait documents are removed instead of all of them.
+    '''
 
     # Remove retracted publications:
     if len(updated_pmids['removed']): 
         print("[Info] Deleting retracted publications from solr: {}".format(updated_pmids['removed']))
-        remove_query = generate_query(updated_pmids['removed'])
-        solr_object.delete_query(remove_query)
 
     # Remove updated publications:
     if len(updated_pmids['updated']): 
         print("[Info] Deleting updated publications from solr: {}".format(updated_pmids['updated']))
-        remove_query = generate_query(updated_pmids['updated'])
-        solr_object.delete_query(remove_query)
+
+    solr_object.delete_queries(get_delete_queries(updated_pmids, chunk_size, trait_queries), report_counts = report_counts)
 
     return 0
 
 
+def get_delete_queries(updated_pmids, chunk_size = 500, trait_queries = None):
+    '''
+    Returns the queries of the trait documents, and the studies and associations of the retracted and updated publications.
+    '''
+
+    # Removing all all trait documents:
+    delete_queries = get_trait_doc_queries() if trait_queries is None else list(trait_queries)
+    delete_queries += generate_queries(updated_pmids['removed'], chunk_size)
+    delete_queries += generate_queries(updated_pmids['updated'], chunk_size)
+
+    return delete_queries
+
+
 
 def generate_query(pmid_list = None):
 
@@ -35,13 +48,67 @@ def generate_query(pmid_list = None):
     return remove_query
 
 
+def generate_queries(pmid_list = None, chunk_size = 500):
+    '''
+    Splits the pmids into chunks, so no query has more boolean clauses than solr's maxBooleanClauses (1024 by default).
+    '''
+    pmid_list = list(pmid_list) if pmid_list else []
+    return [generate_query(pmid_list[i:i + chunk_size]) for i in range(0, len(pmid_list), chunk_size)]
+
+
+def get_trait_doc_queries():
+    '''
+    Queries matching all trait documents.
+    '''
+    return ["resourcename:efotrait", "resourcename:diseasetrait"]
+
+
+def quote(value):
+    '''
+    Quotes a value for solr queries (eg. URIs or trait names with spaces).
+    '''
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def generate_trait_queries(efo_uris = None, disease_traits = None, chunk_size = 500):
+    '''
+    Queries matching the trait documents of the given EFO URIs and reported traits only.
+    '''
+    efo_uris = sorted(efo_uris) if efo_uris else []
+    disease_traits = sorted(disease_traits) if disease_traits else []
+
+    queries = ['resourcename:efotrait AND ( {} )'.format(' OR '.join(['mappedUri:{}'.format(quote(uri)) for uri in efo_uris[i:i + chunk_size]]))
+               for i in range(0, len(efo_uris), chunk_size)]
+    queries += ['resourcename:diseasetrait AND ( {} )'.format(' OR '.join(['traitName_s:{}'.format(quote(trait)) for trait in disease_traits[i:i + chunk_size]]))
+                for i in range(0, len(disease_traits), chunk_size)]
+    return queries
+
+
+def get_indexed_traits(solr_object, pmid_list = None, chunk_size = 500):
+    '''
+    Returns the EFO URIs and reported traits of the indexed studies of the given publications, as they are in solr before the update.
+    '''
+    efo_uris = set()
+    disease_traits = set()
+    pmid_list = list(pmid_list) if pmid_list else []
+
+    for i in range(0, len(pmid_list), chunk_size):
+        pmid_query = ' OR '.join(['pubmedId:{}'.format(pmid) for pmid in pmid_list[i:i + chunk_size]])
+        for docs in solr_object.iter_docs(term = '( {} )'.format(pmid_query), resourcename = 'study', fl = ['mappedUri', 'traitName_s']):
+            for doc in docs:
+                efo_uris.update(doc.get('mappedUri', []))
+                if doc.get('traitName_s'):
+                    disease_traits.add(doc['traitName_s'])
+
+    return efo_uris, disease_traits
+
+
 # Removing all efo and disease trait documents:
 def remove_trait_docs(solr_object):
     '''
     Simple query to remve all trait documents.
     '''
     
-    solr_object.delete_query("resourcename:efotrait") # removing EFO trait documents
-    solr_object.delete_query("resourcename:diseasetrait") # removing disease trait documents
+    solr_object.delete_queries(get_trait_doc_queries()) # removing EFO and disease trait documents
     
     return 0
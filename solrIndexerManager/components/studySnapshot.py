@@ -0,0 +1,51 @@
+import glob
+import os
+import pandas as pd
+
+# Parquet needs pyarrow, without it the tables are saved as compressed pickles:
+try:
+    import pyarrow
+    snapshot_format = 'parquet'
+except ImportError:
+    snapshot_format = 'pkl.gz'
+
+
+def get_snapshot_file(snapshot_dir, instance):
+    return os.path.join(snapshot_dir, 'studies_{}.{}'.format(instance, snapshot_format))
+
+
+def save_studies(study_table, snapshot_dir, instance):
+    '''
+    Saves the study table fetched from the database instance, so it can be used as the old release next time.
+    '''
+    snapshot_file = get_snapshot_file(snapshot_dir, instance)
+    if snapshot_format == 'parquet':
+        study_table.to_parquet(snapshot_file, index=False)
+    else:
+        study_table.to_pickle(snapshot_file, compression='gzip')
+    print('[Info] Study table of {} saved to {}'.format(instance, snapshot_file))
+
+
+def load_studies(snapshot_dir, instance=None, exclude=None):
+    '''
+    Returns the saved study table of the database instance or None if it was not saved. Without instance name,
+    the most recent snapshot is returned (snapshots of the excluded instance are skipped).
+    '''
+    if instance:
+        snapshot_files = glob.glob(os.path.join(snapshot_dir, 'studies_{}.*'.format(instance)))
+    else:
+        snapshot_files = [snapshot_file for snapshot_file in glob.glob(os.path.join(snapshot_dir, 'studies_*.*'))
+                          if not exclude or not os.path.basename(snapshot_file).startswith('studies_{}.'.format(exclude))]
+
+    if not snapshot_files:
+        return None
+
+    snapshot_file = max(snapshot_files, key=os.path.getmtime)
+    if snapshot_file.endswith('.parquet'):
+        study_table = pd.read_parquet(snapshot_file)
+    else:
+        study_table = pd.read_pickle(snapshot_file, compression='gzip')
+
+    study_table.index = study_table.ACCESSION_ID.tolist()
+    print('[Info] Study table of {} studies read from {}'.format(len(study_table), snapshot_file))
+    return study_table
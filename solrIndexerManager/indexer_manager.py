@@ -5,11 +5,17 @@ import time
 import os
 import sys
 import json
+import hashlib
 import subprocess
 
 # Loading components:
 from solrIndexerManager.components import getUpdated
 from solrIndexerManager.components import solrUpdater
+from solrIndexerManager.components import contentHash
+from solrIndexerManager.components import studySnapshot
+from solrIndexerManager.components import jobScheduler
+from solrIndexerManager.components import runtimeHistory
+from solrIndexerManager.components import localExecutor
 
 class IndexerManager:
     def __init__(self, 
@@ -26,7 +32,19 @@ class IndexerManager:
                  job_group=None, 
                  workingDir=None, 
                  queue=None,
-                 nfScriptPath=None):
+                 nfScriptPath=None,
+                 verbose=None,
+                 hashSnapshot=None,
+                 snapshotDir=None,
+                 batchSize=None,
+                 batchAssociations=None,
+                 longestFirst=None,
+                 runtimeHistory=None,
+                 executor='nextflow',
+                 workers=4,
+                 incrementalTraits=None,
+                 traitFileOption=None,
+                 queueSize=None):
         self.newInstance = newInstance
         self.oldInstance = oldInstance
         self.solrHost = solrHost
@@ -43,77 +61,382 @@ class IndexerManager:
         self.db_updates = None
         self.nfScriptPath = nfScriptPath
         self.job_file = None
+        self.verbose = verbose
+        self.hashSnapshot = hashSnapshot
+        self.study_hashes = None
+        self.snapshotDir = snapshotDir
+        self.new_studies = None
+        self.batchSize = batchSize
+        self.batchAssociations = batchAssociations
+        self.job_pmids = {}
+        self.longestFirst = longestFirst
+        self.association_counts = None
+        self.job_costs = None
+        self.runtimeHistory = runtimeHistory
+        self.trace_files = []
+        self.executor = executor
+        self.workers = workers
+        self.job_records = []
+        self.incrementalTraits = incrementalTraits
+        self.traitFileOption = traitFileOption
+        self.affected_traits = None
+        self.trait_files = {}
+        self.costs_in_seconds = False
+        self.queueSize = queueSize
         
 
     def job_generator(self):
         """
         This function generates the jobs based on the provided wrapper script and the dictionary with the db updates.
+        If batching is enabled, multiple pubmed IDs are indexed by one job. The pubmed IDs of each job are saved in self.job_pmids.
     
         Return data:
         {
             ${pmid} : './${wrapper} -d -e -p ${pmid}',
             ...
+            batch_${n} : './${wrapper} -d -e -p ${pmid1} -p ${pmid2} ...', # with batching
+            ...
             efotrait : './${wrapper} -a -s -d',
             diseasetrait : './${wrapper} -a -s -e'
         }
+
+        With incremental trait indexing, the trait jobs only regenerate the affected traits, listed in a file passed
+        to the wrapper with the trait file option (eg. './${wrapper} -a -s -d ${option} efo_traits.txt'). The traits
+        are kept in self.trait_files, the files are written with the job map.
         """
+        pmids = list(dict.fromkeys(pmid for x in self.db_updates.values() for pmid in x if pmid != '*'))
     
-        # Indexing jobs with associations and studies for each pubmed ID:
-        jobs = {pmid : '{} -d -e -p {}'.format(self.wrapperScript, pmid) for x in self.db_updates.values() for pmid in x if pmid != '*'}
+        # Indexing jobs with associations and studies for each pubmed ID or batch of pubmed IDs:
+        if self.batchAssociations:
+            self.job_pmids = {'batch_{}'.format(i + 1) : batch for i, batch in enumerate(jobScheduler.batch_by_cost(pmids, self.get_association_counts(), self.batchAssociations))}
+        elif self.batchSize:
+            self.job_pmids = {'batch_{}'.format(i + 1) : batch for i, batch in enumerate(jobScheduler.batch_by_size(pmids, self.batchSize))}
+        else:
+            self.job_pmids = {str(pmid) : [pmid] for pmid in pmids}
+        jobs = {job_id : '{} -d -e {}'.format(self.wrapperScript, ' '.join(['-p {}'.format(pmid) for pmid in batch])) for job_id, batch in self.job_pmids.items()}
         # Indexing job to generate disease trait and efo trait documents:
-        jobs['efo_traits'] = '{} -a -s -d '.format(self.wrapperScript)
-        jobs['disease_traits'] = '{} -a -s -e '.format(self.wrapperScript)
+        if self.incrementalTraits and not self.fullIndex:
+            efo_uris, disease_traits = self.get_affected_traits()
+            for job_id, options, traits in [('efo_traits', '-a -s -d', efo_uris), ('disease_traits', '-a -s -e', disease_traits)]:
+                if not traits:
+                    continue
+                trait_file = os.path.join(self.logDir, '{}.txt'.format(job_id))
+                self.trait_files[trait_file] = sorted(traits)
+                jobs[job_id] = '{} {} {} {}'.format(self.wrapperScript, options, self.traitFileOption, trait_file)
+                self.job_pmids[job_id] = []
+        else:
+            jobs['efo_traits'] = '{} -a -s -d '.format(self.wrapperScript)
+            jobs['disease_traits'] = '{} -a -s -e '.format(self.wrapperScript)
+            self.job_pmids['efo_traits'] = []
+            self.job_pmids['disease_traits'] = []
         return jobs
 
+    def get_affected_traits(self):
+        """
+        EFO URIs and reported traits touched by the changed publications: the traits of the removed and updated
+        publications as they are indexed in solr, and the traits of the added and updated publications in the new
+        database instance. Has to be called before the solr documents are removed.
+
+        The traits are saved by prepare_solr before the deletion: a rerun of the same updates reads them back, as the
+        traits of the deleted documents can't be read from solr any more.
+        """
+        if self.affected_traits is None and os.path.isfile(self.get_trait_list_file()):
+            with open(self.get_trait_list_file()) as f:
+                saved_traits = json.load(f)
+            self.affected_traits = (set(saved_traits['efo_uris']), set(saved_traits['disease_traits']))
+            print('[Info] Affected traits of a previous run read from {}'.format(self.get_trait_list_file()))
+
+        if self.affected_traits is None:
+            old_pmids = self.db_updates['removed'] + self.db_updates['updated']
+            new_pmids = self.db_updates['added'] + self.db_updates['updated']
+
+            solr_object = solr_wrapper.solrWrapper(host=self.solrHost, port=self.solrPort, core=self.solrCore)
+            old_efo_uris, old_disease_traits = solrUpdater.get_indexed_traits(solr_object, old_pmids)
+            new_efo_uris, new_disease_traits = getUpdated.get_traits(self.newInstance, new_pmids)
+
+            self.affected_traits = (old_efo_uris | new_efo_uris, old_disease_traits | new_disease_traits)
+            print('[Info] Number of affected EFO traits: {}, reported traits: {}'.format(*[len(traits) for traits in self.affected_traits]))
+        return self.affected_traits
 
-    def get_database_updates(self):
-        # Determine updates by comparing old and new database instances:
-        new_table = getUpdated.get_studies(self.newInstance)
+    def get_trait_list_file(self):
+        # The affected traits are saved for each set of database updates (digest of the sorted pubmed IDs):
+        updates = json.dumps({key : sorted(str(pmid) for pmid in pmids) for key, pmids in self.db_updates.items()}, sort_keys=True)
+        digest = hashlib.sha1(updates.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.logDir, 'affected_traits_{}_{}.json'.format(self.newInstance, digest))
+
+    def save_affected_traits(self):
+        efo_uris, disease_traits = self.get_affected_traits()
+        with open(self.get_trait_list_file(), 'w') as f:
+            json.dump({'efo_uris' : sorted(efo_uris), 'disease_traits' : sorted(disease_traits)}, f)
+
+    def get_association_counts(self):
+        # Number of associations of each pubmed ID in the new database instance, used for batching:
+        if self.association_counts is None:
+            self.association_counts = getUpdated.get_association_counts(self.newInstance)
+        return self.association_counts
+
+    def get_job_costs(self):
+        """
+        Estimated cost of indexing each pubmed ID, used to order the jobs: the number of associations in the new database instance.
+        If the runtime history is given, the median runtime of the previous indexings is used instead. For pubmed IDs
+        indexed for the first time, the runtime is estimated from the association count (median seconds per association).
+        """
+        if self.job_costs is None:
+            self.job_costs = self.get_association_counts()
+            # A missing history file is not created here, so the dry run writes nothing:
+            if self.runtimeHistory and os.path.isfile(self.runtimeHistory):
+                with runtimeHistory.RuntimeHistory(self.runtimeHistory) as history:
+                    runtimes = history.get_pmid_costs()
+                association_counts = self.get_association_counts()
+                known = runtimes.index.intersection(association_counts.index)
+                if len(known):
+                    seconds_per_association = (runtimes[known] / association_counts[known].clip(lower=1)).median()
+                    estimates = association_counts * seconds_per_association
+                    self.job_costs = runtimes.combine_first(estimates)
+                    self.costs_in_seconds = True
+                    print('[Info] Job costs are estimated from the runtimes of {} publications.'.format(len(runtimes)))
+        return self.job_costs
+
+
+    def get_database_updates(self, save_diff=True):
+        # Determine updates by comparing old and new database instances (the list of changed studies is not saved in dry runs):
         # The update object is generated depending on if the flag is enabled or not:
         if self.fullIndex:
             db_updates = {
-                "added": new_table.PUBMED_ID.unique().tolist(),  # As if all publications in the new table was newly added
+                "added": self.get_new_studies().PUBMED_ID.unique().tolist(),  # As if all publications in the new table was newly added
                 "removed": ['*'],  # As if all publications were removed.
                 "updated": []
             }
+        elif self.hashSnapshot:
+            db_updates = self.get_content_updates()
         else:
-            old_table = getUpdated.get_studies(self.oldInstance)
-            db_updates = getUpdated.get_db_updates(old_table, new_table)
+            old_table = self.get_old_studies()
+            db_updates = getUpdated.get_db_updates(old_table, self.get_new_studies(), diff_file=os.path.join(self.logDir, 'release_diff.tsv') if save_diff else None)
         return db_updates
+
+    def save_study_snapshot(self):
+        # The study table is only saved after a successful indexing, so the next run compares against the last indexed release:
+        if self.snapshotDir:
+            studySnapshot.save_studies(self.get_new_studies(), self.snapshotDir, self.newInstance)
+
+    def get_new_studies(self):
+        # The study table of the new instance is only queried once, and only if needed (eg. not for content hash comparison):
+        if self.new_studies is None:
+            self.new_studies = getUpdated.get_studies(self.newInstance)
+        return self.new_studies
+
+    def get_old_studies(self):
+        """
+        The study table of the old release is read from the snapshot saved by the previous run if available,
+        so the old database instance is only queried if there's no snapshot.
+        """
+        if self.snapshotDir:
+            old_table = studySnapshot.load_studies(self.snapshotDir, self.oldInstance, exclude=self.newInstance)
+            if old_table is not None:
+                return old_table
+            print('[Info] No saved study table found for the old release in {}.'.format(self.snapshotDir))
+
+        if not self.oldInstance:
+            raise ValueError('[Error] The old database instance needs to be specified if there is no saved study table.')
+        return getUpdated.get_studies(self.oldInstance)
+
+    def get_content_updates(self):
+        """
+        Determine updates by comparing the content hash of each study with the hashes saved for the previous release.
+        Without a snapshot, the hashes are calculated from the old database instance.
+        """
+        self.study_hashes = contentHash.get_study_hashes(contentHash.get_content_tables(self.newInstance))
+        old_hashes = contentHash.read_snapshot(self.hashSnapshot)
+        if old_hashes is None:
+            print('[Info] Calculating content hashes from the old database instance ({}).'.format(self.oldInstance))
+            old_hashes = contentHash.get_study_hashes(contentHash.get_content_tables(self.oldInstance))
+        return contentHash.get_hash_updates(old_hashes, self.study_hashes)
+
+    def save_content_hashes(self):
+        # The snapshot is only updated after a successful indexing, so failed changes are picked up by the next run:
+        if self.hashSnapshot:
+            if self.study_hashes is None:
+                self.study_hashes = contentHash.get_study_hashes(contentHash.get_content_tables(self.newInstance))
+            contentHash.save_snapshot(self.study_hashes, self.hashSnapshot)
     
     def set_database_updates(self, db_updates):
         self.db_updates = db_updates
 
     def generate_job_list_file(self):
         job_map = self.job_generator()
+
+        # The most expensive jobs are written first, so they are started first and don't delay the end of the run:
+        if self.longestFirst:
+            job_map = {job_id : job_map[job_id] for job_id in jobScheduler.order_by_cost(self.job_pmids, self.get_job_costs())}
+
+        for trait_file, traits in self.trait_files.items():
+            with open(trait_file, 'w') as f:
+                f.write(''.join(['{}\n'.format(trait) for trait in traits]))
+
         self.job_file = os.path.join(self.logDir, 'job_map.csv')
         with open(self.job_file, 'w') as f:
-            for k, v in job_map.items():
-                s = ",".join([k, v]) + "\n"
-                f.write(s)
-                
+            f.write(''.join(self.format_job_lines(job_map)))
+
+    def format_job_lines(self, job_map):
+        # job ID, space separated list of indexed pubmed IDs and the command:
+        return [",".join([k, ' '.join([str(pmid) for pmid in self.job_pmids.get(k, [])]), v]) + "\n" for k, v in job_map.items()]
+
+    def get_solr_deletions(self, completed=()):
+        """
+        Returns the database updates and the trait queries of the documents to be deleted from solr. On a rerun of the
+        same job map, the documents indexed by the completed jobs are kept, and only the documents of the remaining jobs
+        are deleted (including the ones partially indexed by the failed jobs).
+        """
+        trait_queries = None
+        if self.incrementalTraits and not self.fullIndex:
+            efo_uris, disease_traits = self.get_affected_traits()
+            trait_queries = solrUpdater.generate_trait_queries(efo_uris if 'efo_traits' not in completed else None,
+                                                               disease_traits if 'disease_traits' not in completed else None)
+        elif completed:
+            trait_queries = [query for job_id, query in zip(['efo_traits', 'disease_traits'], solrUpdater.get_trait_doc_queries())
+                             if job_id not in completed]
+
+        if not completed:
+            return self.db_updates, trait_queries
+        pending = [pmid for job_id, pmids in self.job_pmids.items() if job_id not in completed for pmid in pmids]
+        return {'added' : [], 'removed' : [], 'updated' : pending}, trait_queries
+
     def prepare_solr(self):
         # Instantiate solr object:
         solr_object = solr_wrapper.solrWrapper(host=self.solrHost, port=self.solrPort, core=self.solrCore)
-        # Removed associations and studies for all updated/deleted studies + removing all trait documents:
-        solrUpdater.removeUpdatedSolrData(solr_object, self.db_updates)
-        
+        # The affected traits are saved before the deletion, so a rerun can find them:
+        if self.incrementalTraits and not self.fullIndex:
+            self.save_affected_traits()
+
+        completed = self.get_completed_jobs()
+        if completed:
+            print('[Info] {} jobs were completed by a previous run, their documents are not deleted.'.format(len(completed)))
+
+        # Removed associations and studies for all updated/deleted studies + removing all (or the affected) trait documents.
+        # Counting documents before and after the deletion takes extra queries, so it is only done in verbose mode:
+        db_updates, trait_queries = self.get_solr_deletions(completed)
+        solrUpdater.removeUpdatedSolrData(solr_object, db_updates, report_counts=self.verbose, trait_queries=trait_queries)
+
+    def read_job_map(self):
+        # Reading the job map, so the order of the jobs is kept:
+        with open(self.job_file) as f:
+            return dict([(line.split(',', 2)[0], line.rstrip('\n').split(',', 2)[2]) for line in f if line.strip()])
+
+    def get_checkpoint_file(self, job_map=None):
+        """
+        Checkpoint of the built-in executor. The file name contains a digest of the job map and the trait files, so the
+        completed jobs of a previous run are only reused if the same jobs (pubmed IDs, commands and traits) are run again.
+        The digest is calculated from the job map file, or from the given job map if the file is not written (plan).
+        """
+        if job_map is not None:
+            content = ''.join(sorted(self.format_job_lines(job_map)))
+        else:
+            with open(self.job_file) as f:
+                content = ''.join(sorted(f))
+        for trait_file in sorted(self.trait_files):
+            content += ''.join(['{}\t{}\n'.format(trait_file, trait) for trait in self.trait_files[trait_file]])
+        digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.logDir, 'completed_jobs_{}_{}.txt'.format(self.newInstance, digest))
+
+    def get_completed_jobs(self, job_map=None):
+        # Jobs of the job map completed by a previous run of the built-in executor (Nextflow runs are not checkpointed):
+        if self.executor == 'nextflow':
+            return set()
+        checkpoint_file = self.get_checkpoint_file(job_map)
+        job_map = self.read_job_map() if job_map is None else job_map
+        return set([job_id for job_id, cmd in localExecutor.read_checkpoint(checkpoint_file) if job_map.get(job_id) == cmd])
+
+    def plan(self):
+        """
+        Estimates the size of the indexing without changing solr or starting any jobs: number of changed publications,
+        number of solr documents to be deleted, number of jobs and the expected runtime (if the runtime history is given).
+        Jobs completed by a previous run of the same job map (checkpoint of the built-in executor) are left out.
+        The plan is printed as JSON, no file is written.
+        """
+        job_map = self.job_generator()
+        if self.longestFirst:
+            job_map = {job_id : job_map[job_id] for job_id in jobScheduler.order_by_cost(self.job_pmids, self.get_job_costs())}
+        completed = self.get_completed_jobs(job_map)
+        pending_jobs = [job_id for job_id in job_map if job_id not in completed]
+
+        # Counting the documents matched by the delete queries. A pubmed ID both removed and updated would be counted
+        # twice, so the queries are built from the unique pubmed IDs (all publications if '*' is given):
+        db_updates, trait_queries = self.get_solr_deletions(completed)
+        pmids = list(dict.fromkeys(db_updates['removed'] + db_updates['updated']))
+        solr_object = solr_wrapper.solrWrapper(host=self.solrHost, port=self.solrPort, core=self.solrCore)
+        delete_queries = solrUpdater.get_delete_queries({'removed' : ['*'] if '*' in pmids else pmids, 'updated' : []}, trait_queries=trait_queries)
+        deleted_documents = sum(solr_wrapper.run_concurrently([lambda query=query: solr_object.get_document_count(term=query) for query in delete_queries], max_workers=4))
+
+        plan = {
+            'publications' : {key : len([pmid for pmid in pmids if pmid != '*']) for key, pmids in self.db_updates.items()},
+            'full_index' : bool(self.fullIndex),
+            'deleted_documents' : deleted_documents,
+            'documents_before_deletion' : solr_object.get_all_document_count(),
+            'jobs' : len(pending_jobs),
+            'completed_jobs' : len(completed),
+            'executor' : self.executor
+        }
+
+        # Runtime estimate from the previous runtimes of the publications and the trait jobs:
+        pmid_costs = self.get_job_costs() if self.runtimeHistory else None
+        if self.costs_in_seconds:
+            with runtimeHistory.RuntimeHistory(self.runtimeHistory) as history:
+                job_runtimes = history.get_job_runtimes()
+            job_costs = [sum([float(pmid_costs.get(str(pmid), 0)) for pmid in self.job_pmids.get(job_id, [])]) if self.job_pmids.get(job_id) else float(job_runtimes.get(job_id, 0))
+                         for job_id in pending_jobs]
+            workers = self.get_parallel_jobs()
+            plan['estimated_job_seconds'] = round(sum(job_costs))
+            plan['estimated_runtime_seconds'] = round(jobScheduler.estimate_makespan(job_costs, workers))
+            plan['parallel_jobs'] = workers
+
+        print(json.dumps(plan, indent=4))
+        return plan
+
+    def get_parallel_jobs(self):
+        """
+        Number of jobs running at the same time: --workers for the built-in executor. For Nextflow, --queueSize if given,
+        otherwise executor.queueSize of the nextflow.config in the launch folder or in the folder of the Nextflow script
+        (the launch folder takes precedence, as in Nextflow).
+        """
+        if self.executor != 'nextflow':
+            return self.workers
+        if self.queueSize:
+            return self.queueSize
+
+        config_files = ['nextflow.config', os.path.join(os.path.dirname(self.nfScriptPath), 'nextflow.config')] if self.nfScriptPath else ['nextflow.config']
+        for config_file in config_files:
+            queue_size = jobScheduler.read_queue_size(config_file)
+            if queue_size:
+                print('[Info] Nextflow queue size ({}) read from {}'.format(queue_size, config_file))
+                return queue_size
+
+        print('[Warning] Nextflow queue size is not set, using the default of Nextflow ({}).'.format(jobScheduler.NEXTFLOW_QUEUE_SIZE))
+        return jobScheduler.NEXTFLOW_QUEUE_SIZE
+
     def run_indexer(self):
         """
-        Indexing is managed by a Nextflow workflow
+        Indexing is managed by a Nextflow workflow, or by the built-in executor (local or lsf)
         """
-        def format_nextflow_command(resume=False):
+        if self.executor != 'nextflow':
+            return self.run_local_indexer()
+
+        def format_nextflow_command(resume=False, trace_file=None):
             resume_option = "-resume" if resume else ""
+            trace_option = f"-with-trace {trace_file}" if trace_file else ""
             return f"""
                     nextflow -log {os.path.join(self.logDir, "nextflow.log")} \
                     run {self.nfScriptPath} \
-                    --job_map_file {self.job_file} {resume_option}
+                    --job_map_file {self.job_file} {resume_option} {trace_option}
                     """
 
         max_attempts = 5
         for attempt in range(1, max_attempts + 1):
             resume = attempt > 1
-            nextflow_cmd = format_nextflow_command(resume=resume)
+            # Each attempt is traced into its own file, the runtimes are saved from all of them:
+            trace_file = os.path.join(self.logDir, f"trace_{attempt}.txt") if self.runtimeHistory else None
+            if trace_file:
+                self.trace_files.append(trace_file)
+            nextflow_cmd = format_nextflow_command(resume=resume, trace_file=trace_file)
             print(f"Attempt {attempt}: Running nextflow: {nextflow_cmd}")
             subproc_cmd = nextflow_cmd.strip().split()
 
@@ -121,6 +444,7 @@ class IndexerManager:
                 process = subprocess.run(subproc_cmd, check=True)
                 print(process.stdout)
                 print("Nextflow command completed successfully.")
+                self.remove_affected_traits()
                 break
             except subprocess.CalledProcessError as e:
                 print(f"Attempt {attempt} failed with error: {e}")
@@ -132,6 +456,46 @@ class IndexerManager:
                     time.sleep(300 * attempt)
                     print("Retrying with -resume option.")
 
+    def run_local_indexer(self):
+        """
+        Runs the jobs of the job map file with the built-in executor. Only the failed jobs are retried, and the completed
+        jobs are saved in a checkpoint file in the log folder (one for each job map), so they are skipped if the indexer
+        is started again with the same jobs. The checkpoint is removed once all jobs are completed.
+        """
+        if self.executor == 'lsf':
+            backend = localExecutor.LsfBackend(queue=self.queue, memory=self.memory, job_group=self.job_group, job_prefix=self.job_prefix)
+        else:
+            backend = localExecutor.LocalBackend()
+
+        checkpoint_file = self.get_checkpoint_file()
+        records, failed = localExecutor.run_jobs(self.read_job_map(), backend, self.logDir, workers=self.workers, checkpoint_file=checkpoint_file)
+        self.job_records = [dict(record, pmids=self.job_pmids.get(record['job_id'], [])) for record in records]
+
+        if failed:
+            raise RuntimeError('[Error] {} indexing jobs failed: {}'.format(len(failed), ', '.join(failed)))
+
+        if os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
+        self.remove_affected_traits()
+
+    def remove_affected_traits(self):
+        # The saved traits are only needed for a rerun of the same updates, they are removed once the indexing is done:
+        if self.incrementalTraits and not self.fullIndex and os.path.isfile(self.get_trait_list_file()):
+            os.remove(self.get_trait_list_file())
+
+    def save_runtimes(self):
+        """
+        Saves the runtimes of the indexing jobs from the Nextflow trace files (or the built-in executor) into the runtime history.
+        """
+        if not self.runtimeHistory:
+            return
+        records = list(self.job_records)
+        for trace_file in self.trace_files:
+            if os.path.isfile(trace_file):
+                records += runtimeHistory.read_trace(trace_file, self.job_pmids)
+        with runtimeHistory.RuntimeHistory(self.runtimeHistory) as history:
+            history.add_runtimes(self.newInstance, records)
+
 
 
 def main():
@@ -158,10 +522,36 @@ def main():
     # Location for log files:
     parser.add_argument('--logFolder', help='Folder into which the log files will be generated.', default="./")
     parser.add_argument('--nfScript', help='Nextflow script path', default=os.path.join(sys.prefix,"nf/solr_indexing.nf"))
+    parser.add_argument('--hashSnapshot', help='File with the content hashes of the studies of the previous release. If given, '
+                        'only studies with changed content are re-indexed, and the file is updated after indexing.', default=None)
+    parser.add_argument('--snapshotDir', help='Folder with the study tables saved by previous runs. The study table of the new '
+                        'instance is saved here after a successful indexing, and the old one is read from here if available.', default=None)
+    # Batching pubmed IDs into indexing jobs:
+    parser.add_argument('--batchSize', help='Number of pubmed IDs indexed by one job.', type=int, default=None)
+    parser.add_argument('--batchAssociations', help='Maximum number of associations indexed by one job (pubmed IDs with more '
+                        'associations get their own job). Overrides --batchSize.', type=int, default=None)
+    parser.add_argument('--longestFirst', help='Flag to start the jobs with the most associations first.', action="store_true")
+    parser.add_argument('--runtimeHistory', help='SQLite file of the indexing runtimes. The runtimes of this run are saved into it, '
+                        'and with --longestFirst the jobs are ordered by their previous runtimes.', default=None)
+    # Regenerating the affected trait documents only:
+    parser.add_argument('--incrementalTraits', help='Flag to delete and regenerate only the trait documents of the changed publications.', action="store_true")
+    parser.add_argument('--traitFileOption', help='Option of the wrapper script to pass the file with the list of traits to index (required by --incrementalTraits).', default=None)
+    # Running the indexing jobs:
+    parser.add_argument('--executor', help='Indexing jobs are run by Nextflow, or by the built-in executor on the local machine or on LSF.',
+                        choices=['nextflow', 'local', 'lsf'], default='nextflow')
+    parser.add_argument('--workers', help='Number of indexing jobs running at the same time with the built-in executor.', type=int, default=4)
+    parser.add_argument('--memory', help='Memory limit of the LSF jobs (MB) with the built-in executor.', type=int, default=None)
+    parser.add_argument('--queue', help='LSF queue of the jobs with the built-in executor.', default=None)
+    # Dry run:
+    parser.add_argument('--plan', help='Flag to only estimate the number of deleted documents, jobs and the runtime, without changing solr, starting jobs or writing files.', action="store_true")
+    parser.add_argument('--queueSize', help='Number of Nextflow jobs running at the same time, used by --plan (default: executor.queueSize from nextflow.config).', type=int, default=None)
     # Print out excessive reports:
     parser.add_argument('--verbose', help='Flag to give more informative output.', action="store_true")
     args = parser.parse_args()
 
+    if args.incrementalTraits and not args.traitFileOption:
+        parser.error('--incrementalTraits requires --traitFileOption.')
+
     # Parser out database instance names:
     newInstance = args.newInstance
     oldInstance = args.oldInstance
@@ -173,6 +563,18 @@ def main():
     fullIndex = args.fullIndex
     nfScriptPath = args.nfScript
     verbose = args.verbose
+    hashSnapshot = args.hashSnapshot
+    snapshotDir = args.snapshotDir
+    batchSize = args.batchSize
+    batchAssociations = args.batchAssociations
+    longestFirst = args.longestFirst
+    runtimeHistory = args.runtimeHistory
+    executor = args.executor
+    workers = args.workers
+    memory = args.memory
+    queue = args.queue
+    incrementalTraits = args.incrementalTraits
+    traitFileOption = args.traitFileOption
 
     # Parse wrapper:
     wrapperScript = args.wrapperScript
@@ -188,12 +590,35 @@ def main():
                              wrapperScript=wrapperScript,
                              logDir=logDir, 
                              fullIndex=fullIndex,
-                             nfScriptPath=nfScriptPath)
-    db_updates = manager.get_database_updates()
+                             nfScriptPath=nfScriptPath,
+                             verbose=verbose,
+                             hashSnapshot=hashSnapshot,
+                             snapshotDir=snapshotDir,
+                             batchSize=batchSize,
+                             batchAssociations=batchAssociations,
+                             longestFirst=longestFirst,
+                             runtimeHistory=runtimeHistory,
+                             executor=executor,
+                             workers=workers,
+                             memory=memory,
+                             queue=queue,
+                             incrementalTraits=incrementalTraits,
+                             traitFileOption=traitFileOption,
+                             queueSize=args.queueSize)
+    db_updates = manager.get_database_updates(save_diff=not args.plan)
     manager.set_database_updates(db_updates=db_updates)
+    if args.plan:
+        manager.plan()
+        return
     manager.generate_job_list_file()
     manager.prepare_solr()
-    manager.run_indexer()
+    # The runtimes are saved even if the indexing failed, so the failed jobs are recorded as well:
+    try:
+        manager.run_indexer()
+    finally:
+        manager.save_runtimes()
+    manager.save_content_hashes()
+    manager.save_study_snapshot()
 
 if __name__ == '__main__':
     main()
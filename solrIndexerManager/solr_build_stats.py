@@ -1,12 +1,16 @@
-import getopt
+import argparse
 import math
 import os
 import re
 import statistics
 import sys
 
+import pandas as pd
 
-def get_build_stats(inputdir):
+from solrIndexerManager.components import runtimeHistory
+
+
+def read_build_logs(inputdir):
     lines = dict()
     for fname in os.listdir(inputdir):
         path = os.path.join(inputdir, fname)
@@ -15,6 +19,11 @@ def get_build_stats(inputdir):
                 for line in file_in:
                     if "Run time" in line:
                         lines[fname] = int(re.split(" +", line)[4])
+    return lines
+
+
+def get_build_stats(inputdir):
+    lines = read_build_logs(inputdir)
     print(lines)
     print("median: " + str(statistics.median(lines.values())))
     print("mean: " + str(statistics.mean(lines.values())))
@@ -30,22 +39,52 @@ def get_build_stats(inputdir):
     print("min: " + minValue + " in " + str(minTime))
     return
 
+
+def import_build_logs(inputdir, history, release):
+    '''
+    Saves the run times of the job logs (one folder for each pubmed ID) into the runtime history.
+    '''
+    records = [{'job_id' : fname, 'pmids' : [fname], 'duration' : runtime} for fname, runtime in read_build_logs(inputdir).items()]
+    history.add_runtimes(release, records)
+
+
+def main():
+    # Parsing commandline arguments
+    parser = argparse.ArgumentParser(description='Statistics of the solr indexing runtimes.')
+
+    parser.add_argument('-d', '--base_dir', help='Folder with the job logs ("Run time" lines of <job>/<job>.o files).', default=None)
+    parser.add_argument('--history', help='SQLite file of the indexing runtime history.', default=None)
+    parser.add_argument('--release', help='Release name under which the job logs are saved into the history.', default=None)
+    parser.add_argument('--percentiles', help='Runtime percentiles (seconds) of a release (--release) or of all runs.', action='store_true')
+    parser.add_argument('--slowest', help='Show the slowest pubmed IDs.', type=int, default=None)
+    parser.add_argument('--trend', help='Show runtime statistics of each release.', action='store_true')
+    args = parser.parse_args()
+
+    # Without history, the statistics of the job logs are printed:
+    if not args.history:
+        get_build_stats(args.base_dir if args.base_dir else ".")
+        return
+
+    pd.set_option('display.width', 200)
+    with runtimeHistory.RuntimeHistory(args.history) as history:
+        if args.base_dir:
+            if not args.release:
+                print('[Error] The release name (--release) is needed to save the job logs.')
+                sys.exit(1)
+            import_build_logs(args.base_dir, history, args.release)
+
+        if args.percentiles:
+            print('[Info] Runtime percentiles (seconds):')
+            print(history.get_percentiles(args.release).to_string())
+
+        if args.slowest:
+            print('[Info] Slowest {} pubmed IDs:'.format(args.slowest))
+            print(history.get_slowest(args.release, args.slowest).to_string(index=False))
+
+        if args.trend:
+            print('[Info] Runtimes across releases (seconds):')
+            print(history.get_trend().to_string())
+
+
 if __name__ == '__main__':
-    #search all output logs,
-    #find "Run time"
-    #print top 10 run times
-    #print average, median, mode
-
-    inputdir = "."
-    try:
-        opts, args = getopt.getopt(sys.argv[1:], "hd:", ["base_dir="])
-    except getopt.GetoptError:
-        print('unpublished_study_export.py -d <base dir>')
-        sys.exit(2)
-    for opt, arg in opts:
-        if opt == '-h':
-            print('unpublished_study_export.py -d <base dir>')
-            sys.exit()
-        elif opt in ("-d", "--base_dir"):
-            inputdir = arg
-    get_build_stats(inputdir)
+    main()
@@ -15,13 +15,13 @@ process run_solr_indexer {
   errorStrategy { task.exitStatus in 129..255 ? 'retry' : 'terminate' }
 
   input:
-  tuple val(id), val(cmd)
+  tuple val(id), val(pmids), val(cmd)
 
   output:
   stdout
 
   """
-  echo $id
+  echo $id $pmids
   $cmd
   """
 }
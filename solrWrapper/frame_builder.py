@@ -0,0 +1,138 @@
+import array
+import numpy as np
+import pandas as pd
+
+class ColumnarFrameBuilder(object):
+    '''
+    Collects batches of solr documents into typed column buffers and builds a single dataframe at the end.
+
+    The type of each field is given upon initialization:
+        * str: python objects (eg. titles, accession IDs)
+        * category: repeated strings (eg. journal names), stored as integer codes
+        * int, float, bool: numpy typed values
+        * multi: multivalued fields, stored as offsets + flat list of values
+
+    Missing values are NaN in the resulting dataframe, integer columns with missing values become float,
+    as it would happen with pd.DataFrame(docs). Multivalued fields are returned as lists, or can be retrieved
+    in long format with get_long_table without building the lists.
+    '''
+
+    __kinds = ['str', 'category', 'int', 'float', 'bool', 'multi']
+
+    def __init__(self, field_types):
+        for field, kind in field_types.items():
+            if kind not in self.__kinds:
+                raise ValueError('[Error] Unknown type ({}) for field {}. Supported types: {}'.format(kind, field, ', '.join(self.__kinds)))
+
+        self.__field_types = dict(field_types)
+        self.__rows = 0
+
+        # Initialize column buffers:
+        self.__values = {}
+        self.__missing = {}
+        self.__categories = {}
+        self.__offsets = {}
+        for field, kind in self.__field_types.items():
+            self.__missing[field] = array.array('b')
+            if kind == 'str':
+                self.__values[field] = []
+            elif kind == 'category':
+                self.__values[field] = array.array('q')
+                self.__categories[field] = {}
+            elif kind == 'int':
+                self.__values[field] = array.array('q')
+            elif kind == 'float':
+                self.__values[field] = array.array('d')
+            elif kind == 'bool':
+                self.__values[field] = array.array('b')
+            elif kind == 'multi':
+                self.__values[field] = []
+                self.__offsets[field] = array.array('q', [0])
+
+    def __len__(self):
+        return self.__rows
+
+    def add_docs(self, docs):
+        '''
+        Appends a batch of documents (list of dictionaries as returned by solr) to the column buffers.
+        '''
+        for field, kind in self.__field_types.items():
+            values = [doc.get(field) for doc in docs]
+            self.__missing[field].extend([value is None for value in values])
+
+            if kind == 'str':
+                self.__values[field].extend(values)
+
+            elif kind == 'category':
+                categories = self.__categories[field]
+                self.__values[field].extend([-1 if value is None else categories.setdefault(value, len(categories)) for value in values])
+
+            elif kind == 'int':
+                self.__values[field].extend([0 if value is None else int(value) for value in values])
+
+            elif kind == 'float':
+                self.__values[field].extend([np.nan if value is None else float(value) for value in values])
+
+            elif kind == 'bool':
+                self.__values[field].extend([bool(value) for value in values])
+
+            elif kind == 'multi':
+                flat = self.__values[field]
+                offsets = self.__offsets[field]
+                for value in values:
+                    if value is not None:
+                        flat.extend(value if isinstance(value, list) else [value])
+                    offsets.append(len(flat))
+
+        self.__rows += len(docs)
+
+    def get_long_table(self, field):
+        '''
+        Returns a multivalued field in long format: one row for each value with the row number of the document.
+        '''
+        offsets = np.frombuffer(self.__offsets[field], dtype=np.int64)
+        return pd.DataFrame({
+            'row': np.repeat(np.arange(self.__rows), np.diff(offsets)),
+            field: pd.Series(self.__values[field], dtype=object)
+        })
+
+    def build(self):
+        '''
+        Returns the dataframe with one column for each field.
+        '''
+        columns = {}
+        for field, kind in self.__field_types.items():
+            missing = np.frombuffer(self.__missing[field], dtype=np.int8).astype(bool)
+
+            if kind == 'str':
+                column = pd.Series(self.__values[field], dtype=object).to_numpy(copy=True)
+                column[missing] = np.nan
+
+            elif kind == 'category':
+                categories = list(self.__categories[field])
+                codes = np.frombuffer(self.__values[field], dtype=np.int64).copy()
+                column = pd.Categorical.from_codes(codes, categories=categories)
+
+            elif kind == 'int':
+                column = np.frombuffer(self.__values[field], dtype=np.int64).copy()
+                if missing.any():
+                    column = column.astype(float)
+                    column[missing] = np.nan
+
+            elif kind == 'float':
+                column = np.frombuffer(self.__values[field], dtype=np.float64).copy()
+
+            elif kind == 'bool':
+                column = np.frombuffer(self.__values[field], dtype=np.int8).astype(bool)
+                if missing.any():
+                    column = column.astype(object)
+                    column[missing] = np.nan
+
+            elif kind == 'multi':
+                offsets = np.frombuffer(self.__offsets[field], dtype=np.int64)
+                flat = self.__values[field]
+                column = pd.Series([np.nan if missing[row] else flat[offsets[row]:offsets[row + 1]] for row in range(self.__rows)], dtype=object)
+
+            columns[field] = column
+
+        return pd.DataFrame(columns, index=pd.RangeIndex(self.__rows))
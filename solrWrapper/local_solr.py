@@ -0,0 +1,548 @@
+'''
+Local stand-in for a solr server, to exercise and benchmark the solr clients of this repository without a live solr.
+
+Only the subset of the solr API used here is implemented:
+    * admin/cores (STATUS, RELOAD), <core>/admin/ping
+    * <core>/select: q, rows, start, fl, sort, facet + facet.field, cursorMark (sorted on the unique key only)
+    * <core>/export: q, fl, sort, streamed in chunks
+    * <core>/update: JSON documents, add, delete by id and by query (repeated delete keys too), commit
+    * <core>/schema: fields guessed from the stored documents
+
+Queries support field:value, field:"quoted value", field:*, *:*, AND, OR and parentheses (adjacent clauses are
+joined by OR as in solr). Documents are kept in memory with an inverted index of every field value.
+'''
+
+import argparse
+import base64
+import bisect
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class QueryError(Exception):
+    pass
+
+
+class DocumentStore(object):
+    '''
+    In-memory documents of a core with an inverted index (field -> value -> set of ids).
+    '''
+
+    __token = re.compile(r'\s*(?:(\()|(\))|(AND|OR)(?=[\s()]|$)|((?:\\.|[^\s():\\])+):("(?:\\.|[^"\\])*"|(?:\\.|[^\s()\\])+))')
+
+    def __init__(self, unique_key='id'):
+        self.unique_key = unique_key
+        self.docs = {}
+        self.index = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _values(value):
+        # Indexed string representation of the (multi)values of a field:
+        for item in (value if isinstance(value, list) else [value]):
+            yield ('true' if item else 'false') if isinstance(item, bool) else str(item)
+
+    def add(self, docs):
+        with self.lock:
+            for doc in docs:
+                doc_id = str(doc[self.unique_key])
+                if doc_id in self.docs:
+                    self._unindex(doc_id)
+                self.docs[doc_id] = dict(doc)
+                for field, value in doc.items():
+                    field_index = self.index.setdefault(field, {})
+                    for item in self._values(value):
+                        field_index.setdefault(item, set()).add(doc_id)
+        return len(docs)
+
+    def _unindex(self, doc_id):
+        for field, value in self.docs[doc_id].items():
+            for item in self._values(value):
+                ids = self.index[field].get(item)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self.index[field][item]
+
+    def delete_ids(self, doc_ids):
+        with self.lock:
+            for doc_id in doc_ids:
+                if doc_id in self.docs:
+                    self._unindex(doc_id)
+                    del self.docs[doc_id]
+
+    def delete_query(self, query):
+        with self.lock:
+            self.delete_ids(list(self.search(query)))
+
+    def search(self, query):
+        '''
+        Returns the set of ids matching the query.
+        '''
+        tokens = self._tokenize(query)
+        with self.lock:
+            ids, position = self._parse_or(tokens, 0)
+        if position != len(tokens):
+            raise QueryError('Unexpected token in query: {}'.format(query))
+        return ids
+
+    def _tokenize(self, query):
+        tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = self.__token.match(query, position)
+            if not match:
+                raise QueryError('Unsupported query syntax at position {}: {}'.format(position, query))
+            tokens.append(match.groups())
+            position = match.end()
+            while position < len(query) and query[position].isspace():
+                position += 1
+        return tokens
+
+    def _parse_or(self, tokens, position):
+        ids, position = self._parse_and(tokens, position)
+        while position < len(tokens):
+            if tokens[position][2] == 'OR':
+                position += 1
+            elif tokens[position][1]:
+                break
+            # Adjacent clauses are joined by the default OR operator:
+            right, position = self._parse_and(tokens, position)
+            ids = ids | right
+        return ids, position
+
+    def _parse_and(self, tokens, position):
+        ids, position = self._parse_clause(tokens, position)
+        while position < len(tokens) and tokens[position][2] == 'AND':
+            right, position = self._parse_clause(tokens, position + 1)
+            ids = ids & right
+        return ids, position
+
+    def _parse_clause(self, tokens, position):
+        if position >= len(tokens):
+            raise QueryError('Query ended unexpectedly.')
+        opening, closing, operator, field, value = tokens[position]
+
+        if opening:
+            ids, position = self._parse_or(tokens, position + 1)
+            if position >= len(tokens) or not tokens[position][1]:
+                raise QueryError('Missing closing parenthesis.')
+            return ids, position + 1
+
+        if not field:
+            raise QueryError('Unexpected token: {}'.format(opening or closing or operator))
+
+        field = re.sub(r'\\(.)', r'\1', field)
+        if value.startswith('"'):
+            value = value[1:-1]
+        value = re.sub(r'\\(.)', r'\1', value)
+
+        if field == '*' and value == '*':
+            return set(self.docs), position + 1
+        if value == '*':
+            return set().union(*self.index.get(field, {}).values()), position + 1
+        return set(self.index.get(field, {}).get(value, set())), position + 1
+
+    def get_docs(self, ids, sort=None):
+        '''
+        Returns the documents in the order of the sort parameter ("field asc, field2 desc"), missing values last.
+        '''
+        with self.lock:
+            docs = [self.docs[doc_id] for doc_id in ids if doc_id in self.docs]
+
+        if sort:
+            # Sorting by the last key first, as python sorts are stable:
+            for clause in reversed([clause.split() for clause in sort.split(',')]):
+                field, direction = clause[0], clause[1] if len(clause) > 1 else 'asc'
+                present = [doc for doc in docs if doc.get(field) is not None]
+                missing = [doc for doc in docs if doc.get(field) is None]
+                present.sort(key=lambda doc: doc[field][0] if isinstance(doc[field], list) else doc[field], reverse=(direction == 'desc'))
+                docs = present + missing
+        return docs
+
+    def get_fields(self):
+        '''
+        Field definitions guessed from the stored values.
+        '''
+        fields = {}
+        with self.lock:
+            for doc in self.docs.values():
+                for field, value in doc.items():
+                    if field in fields:
+                        fields[field]['multiValued'] |= isinstance(value, list)
+                        continue
+                    item = value[0] if isinstance(value, list) and value else value
+                    field_type = ('boolean' if isinstance(item, bool) else 'plong' if isinstance(item, int)
+                                  else 'pdouble' if isinstance(item, float) else 'string')
+                    fields[field] = {'name' : field, 'type' : field_type, 'multiValued' : isinstance(value, list),
+                                     'indexed' : True, 'stored' : True, 'docValues' : True}
+        return list(fields.values())
+
+
+class _DuplicateKeyObject(dict):
+    # Keeps all key/value pairs of a JSON object, solr update messages can repeat keys (eg. "delete"):
+    def __init__(self, pairs):
+        super().__init__(pairs)
+        self.pairs = pairs
+
+
+class _SolrRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def _send_json(self, content, status=200):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json({'responseHeader' : {'status' : status}, 'error' : {'msg' : message, 'code' : status}}, status)
+
+    def _route(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] != 'solr':
+            return None, None, params
+        return parts[1:], url, params
+
+    def do_GET(self):
+        parts, url, params = self._route()
+        try:
+            if parts is None:
+                return self._send_error(404, 'Not found: {}'.format(self.path))
+            if parts[:2] == ['admin', 'cores']:
+                return self._send_json(self.server.cores_admin(params))
+
+            core = self.server.get_core(parts[0]) if parts else None
+            if core is None:
+                return self._send_error(404, 'Core not found: {}'.format(self.path))
+
+            handler = '/'.join(parts[1:])
+            if handler == 'admin/ping':
+                return self._send_json({'responseHeader' : {'status' : 0}, 'status' : 'OK'})
+            if handler == 'select':
+                return self._send_json(self.server.select(core, params))
+            if handler == 'export':
+                return self._export(core, params)
+            if handler == 'schema':
+                return self._send_json({'responseHeader' : {'status' : 0}, 'schema' : {'name' : parts[0], 'uniqueKey' : core.unique_key, 'fields' : core.get_fields()}})
+            return self._send_error(404, 'Unsupported handler: {}'.format(handler))
+
+        except QueryError as e:
+            return self._send_error(400, str(e))
+
+    def do_POST(self):
+        parts, url, params = self._route()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            if not parts or len(parts) < 2 or parts[1] != 'update':
+                return self._send_error(404, 'Unsupported handler: {}'.format(self.path))
+            core = self.server.get_core(parts[0])
+            if core is None:
+                return self._send_error(404, 'Core not found: {}'.format(parts[0]))
+            self.server.update(core, json.loads(body.decode('utf-8'), object_pairs_hook=_DuplicateKeyObject) if body else {})
+            return self._send_json({'responseHeader' : {'status' : 0, 'QTime' : 0}})
+
+        except (QueryError, ValueError, KeyError) as e:
+            return self._send_error(400, str(e))
+
+    def _export(self, core, params):
+        if 'fl' not in params or 'sort' not in params:
+            return self._send_error(400, 'export requires the fl and sort parameters.')
+        fields = params['fl'][0].split(',')
+        docs = core.get_docs(core.search(params.get('q', ['*:*'])[0]), params['sort'][0])
+
+        # The response is streamed with chunked transfer encoding:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_chunk(data):
+            data = data.encode('utf-8')
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+
+        write_chunk('{{"responseHeader":{{"status":0}},"response":{{"numFound":{},"docs":['.format(len(docs)))
+        for start in range(0, len(docs), 1000):
+            batch = [{field : doc[field] for field in fields if field in doc} for doc in docs[start:start + 1000]]
+            write_chunk((',' if start else '') + ','.join([json.dumps(doc) for doc in batch]))
+        write_chunk(']}}')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class LocalSolr(ThreadingHTTPServer):
+    '''
+    Local solr stand-in serving in-memory cores on a background thread.
+
+    Example:
+        with LocalSolr(cores=['gwas']) as server:
+            server.add_documents('gwas', generate_documents(publications=100))
+            solr = solrWrapper(server.host, server.port, 'gwas')
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, cores=('gwas',), port=0, verbose=False):
+        super().__init__(('127.0.0.1', port), _SolrRequestHandler)
+        self.cores = {core : DocumentStore() for core in cores}
+        self.verbose = verbose
+        self.host = 'http://127.0.0.1'
+        self.port = self.server_address[1]
+        self.__thread = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+        print('[Info] Local solr stand-in is listening on {}:{}/solr/ (cores: {})'.format(self.host, self.port, ', '.join(self.cores)))
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_core(self, core):
+        return self.cores.get(core)
+
+    def add_documents(self, core, docs):
+        return self.cores[core].add(list(docs))
+
+    def cores_admin(self, params):
+        action = params.get('action', ['STATUS'])[0]
+        if action == 'RELOAD':
+            return {'responseHeader' : {'status' : 0}}
+        return {'responseHeader' : {'status' : 0},
+                'status' : {name : {'name' : name, 'index' : {'numDocs' : len(core)}} for name, core in self.cores.items()}}
+
+    def select(self, core, params):
+        query = params.get('q', ['*:*'])[0]
+        rows = int(params.get('rows', ['10'])[0])
+        start = int(params.get('start', ['0'])[0])
+        sort = params.get('sort', [None])[0]
+        fields = params['fl'][0].split(',') if 'fl' in params else None
+        cursor = params.get('cursorMark', [None])[0]
+
+        ids = core.search(query)
+        result = {'responseHeader' : {'status' : 0, 'params' : {key : value[0] for key, value in params.items()}}}
+
+        if cursor:
+            # Cursors are only supported on the unique key, the mark is the last returned key:
+            if not sort or sort.split()[0] != core.unique_key or ',' in sort:
+                raise QueryError('Cursor functionality requires a sort on the uniqueKey field ({}) in this stand-in.'.format(core.unique_key))
+            descending = len(sort.split()) > 1 and sort.split()[1] == 'desc'
+            keys = sorted(ids, reverse=descending)
+            first = 0
+            if cursor != '*':
+                last = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+                first = len(keys) - bisect.bisect_left(keys[::-1], last) if descending else bisect.bisect_right(keys, last)
+            page = core.get_docs(keys[first:first + rows])
+            result['nextCursorMark'] = base64.urlsafe_b64encode(str(page[-1][core.unique_key]).encode('utf-8')).decode('ascii') if page else cursor
+        else:
+            page = core.get_docs(ids, sort)[start:start + rows] if rows else []
+
+        if fields:
+            page = [{field : doc[field] for field in fields if field in doc} for doc in page]
+        result['response'] = {'numFound' : len(ids), 'start' : start, 'docs' : page}
+
+        # Facet counts ordered by count, as solr does by default:
+        if params.get('facet', ['false'])[0] == 'true':
+            facet_fields = {}
+            for field in params.get('facet.field', []):
+                counts = sorted([(value, len(value_ids & ids)) for value, value_ids in core.index.get(field, {}).items()],
+                                key=lambda x: (-x[1], x[0]))
+                facet_fields[field] = [item for value, count in counts if count for item in (value, count)]
+            result['facet_counts'] = {'facet_queries' : {}, 'facet_fields' : facet_fields}
+
+        return result
+
+    def update(self, core, message):
+        # A list of documents:
+        if isinstance(message, list):
+            core.add(message)
+            return
+
+        for command, value in message.pairs if isinstance(message, _DuplicateKeyObject) else message.items():
+            if command == 'add':
+                core.add([item['doc'] for item in (value if isinstance(value, list) else [value])])
+            elif command == 'delete':
+                for item in (value if isinstance(value, list) else [value]):
+                    if isinstance(item, dict) and 'query' in item:
+                        core.delete_query(item['query'])
+                    else:
+                        core.delete_ids([str(item['id'] if isinstance(item, dict) else item)])
+            elif command not in ('commit', 'optimize', 'rollback'):
+                raise QueryError('Unsupported update command: {}'.format(command))
+
+
+def generate_documents(publications=5000, seed=0, efo_traits=2600, disease_traits=4700, efo_error_rate=0.0):
+    '''
+    Generates a catalog-like set of study, association, efotrait and diseasetrait documents. The default
+    parameters give about 5700 studies and 115000 associations, larger cores can be generated with more publications.
+    efo_error_rate: fraction of studies where an efoLink (label|short form|uri) has a different label or is missing.
+    '''
+    rng = random.Random(seed)
+    journals = ['Nat Genet', 'Nat Commun', 'Am J Hum Genet', 'PLoS Genet', 'Hum Mol Genet', 'Sci Rep', 'Diabetes', 'Nature']
+    surnames = ['Smith', 'Wang', 'Kim', 'Garcia', 'Nagy', 'Suzuki', 'Müller', 'Okafor', 'Rossi', 'Jensen']
+
+    efo = [('trait {}'.format(i), 'EFO_{:07d}'.format(i), 'http://www.ebi.ac.uk/efo/EFO_{:07d}'.format(i)) for i in range(efo_traits)]
+    reported = ['reported trait {}'.format(i) for i in range(disease_traits)]
+
+    docs = []
+    study_number = 0
+    association_number = 0
+    for publication in range(publications):
+        pmid = str(20000000 + publication)
+        author = '{} {}'.format(rng.choice(surnames), chr(65 + rng.randrange(26)))
+        journal = rng.choice(journals)
+        published = datetime.date(2008, 1, 1) + datetime.timedelta(days=rng.randrange(5000))
+        title = 'Genome-wide association study of {} traits in {} individuals'.format(rng.randrange(1, 20), rng.randrange(1000, 500000))
+
+        for _ in range(1 + int(rng.expovariate(2))):
+            study_number += 1
+            accession = 'GCST{:06d}'.format(study_number)
+            trait = rng.choice(reported)
+            mapped = rng.sample(efo, 1 + int(rng.expovariate(3)))
+            association_count = min(int(rng.lognormvariate(2.3, 1.2)), 5000)
+
+            efo_links = ['{}|{}|{}'.format(label, short_form, uri) for label, short_form, uri in mapped]
+            if rng.random() < efo_error_rate:
+                if rng.random() < 0.5:
+                    efo_links[0] = 'obsolete {}'.format(efo_links[0])
+                else:
+                    efo_links = efo_links[1:]
+
+            docs.append({
+                'id' : 'study:{}'.format(study_number),
+                'resourcename' : 'study',
+                'accessionId' : accession,
+                'pubmedId' : pmid,
+                'title' : title,
+                'author_s' : author,
+                'publication' : journal,
+                'publicationDate' : '{}T00:00:00Z'.format(published),
+                'catalogPublishDate' : '{}T00:00:00Z'.format(published + datetime.timedelta(days=rng.randrange(30, 400))),
+                'fullPvalueSet' : rng.random() < 0.3,
+                'associationCount' : association_count,
+                'traitName_s' : trait,
+                'mappedLabel' : [label for label, short_form, uri in mapped],
+                'mappedUri' : [uri for label, short_form, uri in mapped],
+                'efoLink' : efo_links
+            })
+
+            for _ in range(association_count):
+                association_number += 1
+                docs.append({
+                    'id' : 'association:{}'.format(association_number),
+                    'resourcename' : 'association',
+                    'accessionId' : accession,
+                    'pubmedId' : pmid,
+                    'strongestAllele' : ['rs{}-{}'.format(rng.randrange(1, 10 ** 8), rng.choice('ACGT'))],
+                    'pValueMantissa' : rng.randrange(1, 10),
+                    'pValueExponent' : -rng.randrange(8, 300),
+                    'chromosomeName' : [str(rng.randrange(1, 23))],
+                    'chromosomePosition' : [rng.randrange(1, 2 * 10 ** 8)],
+                    'traitName_s' : trait,
+                    'mappedLabel' : [label for label, short_form, uri in mapped],
+                    'mappedUri' : [uri for label, short_form, uri in mapped]
+                })
+
+    docs += [{'id' : 'efotrait:{}'.format(short_form), 'resourcename' : 'efotrait', 'shortForm' : [short_form],
+              'mappedLabel' : [label], 'mappedUri' : [uri]} for label, short_form, uri in efo]
+    docs += [{'id' : 'diseasetrait:{}'.format(i), 'resourcename' : 'diseasetrait', 'traitName_s' : trait,
+              'traitName' : [trait]} for i, trait in enumerate(reported)]
+    return docs
+
+
+def benchmark(host, port, core, repeats=3):
+    '''
+    Times the main solrWrapper calls against the server. Returns the fastest time of each call in seconds.
+    '''
+    from solrWrapper.solr_wrapper import solrWrapper
+
+    solr = solrWrapper(host, port, core)
+    pmids = [str(20000000 + i) for i in range(100)]
+    pmid_query = '( {} )'.format(' OR '.join(['pubmedId:{}'.format(pmid) for pmid in pmids]))
+    removed = [doc for docs in solr.iter_docs(term=pmid_query) for doc in docs]
+
+    # Calls with the untimed call restoring the core after each run:
+    calls = [
+        ('get_facets', solr.get_facets, None),
+        ('get_all_document_count', solr.get_all_document_count, None),
+        ('get_study_table', solr.get_study_table, None),
+        ('iter_docs (associations)', lambda: sum([len(docs) for docs in solr.iter_docs(resourcename='association', fl=['id', 'pubmedId'])]), None),
+        ('export (associations)', lambda: sum([len(docs) for docs in solr.export(fl=['id', 'pubmedId'], resourcename='association')]), None),
+        ('delete_queries (100 publications)', lambda: solr.delete_queries(['(resourcename:study OR resourcename:association) AND {}'.format(pmid_query)]),
+         lambda: solr.add_documents(removed, batch_size=1000)),
+        ('add_documents (100 publications)', lambda: solr.add_documents(removed, batch_size=1000), None),
+    ]
+
+    timings = {}
+    for name, call, reset in calls:
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call()
+            runs.append(time.perf_counter() - start)
+            if reset:
+                reset()
+        timings[name] = min(runs)
+
+    for name, seconds in timings.items():
+        print('[Info] {}: {:.3f} seconds'.format(name, seconds))
+
+    solr.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in solr server with generated GWAS Catalog documents.')
+    parser.add_argument('-p', '--port', default=8983, help='Port to listen on (0: any free port).', type=int)
+    parser.add_argument('-c', '--core', default='gwas', help='Name of the core.')
+    parser.add_argument('-n', '--publications', default=5000, help='Number of generated publications.', type=int)
+    parser.add_argument('--efoErrorRate', default=0.0, help='Fraction of studies with inconsistent efoLink values.', type=float)
+    parser.add_argument('--seed', default=0, help='Seed of the data generator.', type=int)
+    parser.add_argument('--benchmark', default=False, help='Time the solrWrapper calls against the server and exit.', action='store_true')
+    parser.add_argument('-v', '--verbose', default=False, help='Log every request.', action='store_true')
+    args = parser.parse_args()
+
+    server = LocalSolr(cores=[args.core], port=args.port, verbose=args.verbose)
+    print('[Info] Generating documents of {} publications...'.format(args.publications))
+    server.add_documents(args.core, generate_documents(publications=args.publications, seed=args.seed, efo_error_rate=args.efoErrorRate))
+    print('[Info] {} documents added to the {} core.'.format(len(server.get_core(args.core)), args.core))
+
+    with server:
+        if args.benchmark:
+            benchmark(server.host, server.port, args.core)
+            return
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print('[Info] Stopping server.')
+
+
+if __name__ == '__main__':
+    main()
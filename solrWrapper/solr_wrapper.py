@@ -1,26 +1,186 @@
 import pandas as pd
 import requests
 import urllib.parse
+import codecs
+import copy
+import itertools
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from solrWrapper.frame_builder import ColumnarFrameBuilder
+
+def _iter_json_array(chunks, key):
+    '''
+    Incremental JSON parser: yields the objects of the array stored under the given key from an iterable of
+    byte chunks, without loading the whole response. Only one decoded object and the unparsed tail are kept.
+    '''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    array_start = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key)))
+    whitespace = re.compile(r'[\s,]*')
+
+    chunks = iter(chunks)
+    buffer = ''
+    position = None
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+
+        # Looking for the start of the array:
+        if position is None:
+            match = array_start.search(buffer)
+            if not match:
+                continue
+            position = match.end()
+
+        # Decoding all complete objects in the buffer:
+        while True:
+            position = whitespace.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The object is not complete yet, reading the next chunk:
+                break
+            yield obj
+
+        buffer = buffer[position:]
+        position = 0
+
+    raise ValueError('[Error] The response ended before the end of the "{}" array.'.format(key))
+
+def run_concurrently(calls, max_workers = None):
+    '''
+    Runs the given functions (eg. queries on different solr hosts/cores) in parallel threads and returns
+    their results in the same order. Exceptions are re-raised.
+
+    Example:
+        old_df, new_df = run_concurrently([oldSolr.get_study_table, newSolr.get_study_table])
+    '''
+    calls = list(calls)
+    with ThreadPoolExecutor(max_workers = max_workers if max_workers else max(1, len(calls))) as executor:
+        futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
 
 class solrWrapper(object):
 
-    def __init__(self, host, port, core, verbose = False):
+    # Core lists of the checked solr servers, shared by all wrappers:
+    _core_lists = {}
+    _core_lists_lock = threading.Lock()
+
+    def __init__(self, host, port, core, verbose = False, pool_size = 10, timeout = (10, 600),
+                 retries = 3, backoff_factor = 0.5, cache_size = 0, lazy = False):
+        '''
+        pool_size: number of connections kept alive to the solr server.
+        timeout: connect and read timeout in seconds, (connect, read) tuple or a single number.
+        retries: number of retries of idempotent (GET) requests on connection errors and 5xx/429 responses,
+            waiting backoff_factor * 2^(retry - 1) seconds between attempts.
+        cache_size: number of query responses kept in memory (0: no caching). Any update, delete or reload
+            empties the cache.
+        lazy: if set, the server and the core are not checked upon initialization, but right before the first request.
+        '''
 
         self.__host = host
         self.__port = port
         self.__core = core
         self.__verbose = verbose
+        self.__timeout = timeout
 
-        # Is the solr up?
-        self.is_server_running()
+        # Pooled, keep-alive session shared by all requests:
+        self.__session = self._create_session(pool_size, retries, backoff_factor)
 
-        # Is there the requested core in the solr?
-        self.is_core_OK()
+        # LRU cache of read-only query responses:
+        self.__cache_size = cache_size
+        self.__cache = OrderedDict()
+        self.__cache_lock = threading.Lock()
+        self.__cache_hits = 0
+        self.__cache_misses = 0
 
         # Adding base URL:
         self.base_url = '{}:{}/solr/{}'.format(self.__host, self.__port, self.__core)
         self.clear_object()
 
+        # The checks submit requests themselves, the flag stops them from triggering the checks again:
+        self.__cores = None
+        self.__checked = False
+        self.__checking = False
+        self.__check_lock = threading.RLock()
+        self.__lazy = lazy
+
+        if not lazy:
+            self._check_connection()
+
+    def _check_connection(self):
+        '''
+        Checks if the server is running and the core is OK, once for the lifetime of the object. Threads sending
+        the first requests wait for the checks to finish. Lazy wrappers reuse the core list of a checked server.
+        '''
+        if self.__checked:
+            return
+
+        with self.__check_lock:
+            if self.__checked or self.__checking:
+                return
+            self.__checking = True
+            try:
+                cores = None
+                if self.__lazy:
+                    with self._core_lists_lock:
+                        cores = self._core_lists.get((self.__host, self.__port))
+
+                # Is the solr up?
+                if cores is None:
+                    self.is_server_running()
+                else:
+                    self.__cores = cores
+
+                # Is there the requested core in the solr?
+                self.is_core_OK()
+                self.__checked = True
+            finally:
+                self.__checking = False
+
+    @staticmethod
+    def _create_session(pool_size, retries, backoff_factor):
+        # POST requests (updates) are not in the default list of retried methods, so they are never resubmitted:
+        retry = Retry(total = retries, backoff_factor = backoff_factor, status_forcelist = [429, 500, 502, 503, 504],
+                      raise_on_status = False)
+        adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return(session)
+
+    def close(self):
+        # Closing the pooled connections:
+        self.__session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def clear_cache(self):
+        with self.__cache_lock:
+            self.__cache.clear()
+
+    def cache_info(self):
+        # Cache statistics for diagnostics:
+        with self.__cache_lock:
+            return({'hits' : self.__cache_hits, 'misses' : self.__cache_misses,
+                    'size' : len(self.__cache), 'maxsize' : self.__cache_size})
+
     def clear_object(self):
         # Initialize internal values:
         self.docs = []
@@ -28,6 +188,7 @@ class solrWrapper(object):
         self.counts = 0
 
     def get_core_list(self):
+        self._check_connection()
         return(self.__cores)
 
     def get_core(self):
@@ -41,6 +202,10 @@ class solrWrapper(object):
 
     def is_core_OK(self):
 
+        # Lazy wrappers need the core list first:
+        if self.__cores is None:
+            self._check_connection()
+
         # Is the core is in the available cores:
         if self.__core not in self.__cores:
             print('[Error] Requested core ({}) is not in the supported cores: {}'.format(
@@ -66,6 +231,8 @@ class solrWrapper(object):
         
         # Parse cores:
         self.__cores = list(content['status'].keys())
+        with self._core_lists_lock:
+            self._core_lists[(self.__host, self.__port)] = self.__cores
         
         # Does it look good:
         print('[Info] Solr server ({}:{}/solr/) is up and running.'.format(self.__host, self.__port))
@@ -79,55 +246,77 @@ class solrWrapper(object):
     def get_study_table(self):
         resource_name = "study"
 
-        # Field list retrieved from solr:
-        fl_list = [
-            "pubmedId",
-            "title",
-            "author_s",
-            "accessionId",
-            "fullPvalueSet",
-            "associationCount",
-            "catalogPublishDate",
-            "publicationDate",
-            "publication",
-            "traitName_s",
-            "mappedLabel",
-            "mappedUri",
-            "efoLink",
-        ]
-
-        self.get_facets()
-        print("[Info] Facets fetched.")
-        rows = self.get_resource_counts(resource_name)
-        print(f"[Info] There are {rows} studies, querying them...")
-        self.query(resourcename=resource_name, fl=fl_list, rows=rows)
-        print("[Info] Query complete.")
+        # Fields retrieved from solr with their column types:
+        field_types = {
+            "pubmedId" : "str",
+            "title" : "str",
+            "author_s" : "category",
+            "accessionId" : "str",
+            "fullPvalueSet" : "bool",
+            "associationCount" : "int",
+            "catalogPublishDate" : "str",
+            "publicationDate" : "str",
+            "publication" : "category",
+            "traitName_s" : "str",
+            "mappedLabel" : "multi",
+            "mappedUri" : "multi",
+            "efoLink" : "multi",
+        }
+
+        # Studies are fetched page by page, and collected into column buffers as they arrive:
+        print("[Info] Querying studies...")
+        builder = ColumnarFrameBuilder(field_types)
+        for docs in self.iter_docs(resourcename=resource_name, fl=list(field_types)):
+            builder.add_docs(docs)
+        print(f"[Info] Query complete, {len(builder)} studies retrieved.")
         print("[Info] Generating dataframe...")
         # Generate dataframe:
-        return pd.DataFrame(self.docs)
+        return builder.build()
 
     
     def reload_core(self):
         URL = '{}:{}/solr/admin/cores?action=RELOAD&core={}'.format(self.__host, self.__port, self.__core)
         content = self._submit(URL)
+        self.clear_cache()
         return(1)
 
-    def delete_query(self, query = None):
+    def delete_query(self, query = None, report_counts = True):
         '''
         This function deletes query from solr
         '''
 
         if query:
+            self.delete_queries([query], report_counts = report_counts)
+
+        else:
+            print('[Info] To delete documents from solr, please specify the query.')
+        
+        return(0)
+
+    def delete_queries(self, queries, report_counts = False):
+        '''
+        Deletes the documents matching any of the queries in a single update request followed by one commit.
+        The document count of the core before and after the deletion is only queried if report_counts is set.
+        '''
+        queries = [query for query in queries if query]
+        if not queries:
+            print('[Info] To delete documents from solr, please specify the query.')
+            return(0)
+
+        if report_counts:
             doc_count = self.get_all_document_count()
+
+        for query in queries:
             print('[Info] The following documents are deleted from solr: {}'.format(query))
-            URL = '{}/update?commit=true'.format(self.base_url)
 
-            content = self._submit(URL, jsonData = {"delete":{ "query" : query }})
+        # Solr accepts repeated delete commands in one JSON update message:
+        body = '{' + ','.join('"delete":{}'.format(json.dumps({"query" : query})) for query in queries) + '}'
+        URL = '{}/update?commit=true'.format(self.base_url)
+        content = self._submit(URL, data = body.encode('utf-8'))
+
+        if report_counts:
             print('[Info] Number of documents in the {} core went from {} to {}'.format(self.__core, doc_count, self.get_all_document_count()))
 
-        else:
-            print('[Info] To delete documents from solr, please specify the query.')
-        
         return(0)
         
     def wipe_core(self):
@@ -140,6 +329,65 @@ class solrWrapper(object):
         content = self._submit(URL, data = open(documentFile, 'rb'))
         return(0)
 
+    def add_documents(self, sources, batch_size = 1000, commit_within = None, workers = 1):
+        '''
+        Adds documents to the core in fixed size batches without committing each batch.
+
+        sources: iterable of JSON document files (holding a list of documents) and/or documents (dictionaries).
+            Files are read one at a time, so a generator of documents is never loaded as a whole.
+        commit_within: if given, solr commits the batches within this many milliseconds by itself, otherwise a
+            single commit is sent once all batches are added.
+        workers: number of batches submitted in parallel over separate connections.
+
+        Returns the number of submitted documents.
+        '''
+        URL = '{}/update'.format(self.base_url)
+        if commit_within:
+            URL += '?commitWithin={}'.format(commit_within)
+
+        documents = self._iter_documents(sources)
+        batches = iter(lambda: list(itertools.islice(documents, batch_size)), [])
+        document_count = 0
+
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            running = set()
+            for batch in batches:
+                # Keeping at most two batches per worker in memory:
+                if len(running) >= 2 * workers:
+                    done, running = wait(running, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+                running.add(executor.submit(self._submit, URL, jsonData = batch))
+                document_count += len(batch)
+
+            for future in running:
+                future.result()
+
+        # One commit for all batches:
+        if not commit_within:
+            self._submit('{}/update'.format(self.base_url), jsonData = {'commit' : {}})
+
+        print('[Info] {} documents added to the {} core.'.format(document_count, self.__core))
+        return(document_count)
+
+    @staticmethod
+    def _iter_documents(sources):
+        for source in sources:
+            if isinstance(source, dict):
+                yield source
+                continue
+
+            # Anything else is a document file:
+            if not os.path.isfile(source):
+                raise ValueError('[Error] Document file ({}) does not exist.'.format(source))
+            with open(source) as f:
+                content = json.load(f)
+            if isinstance(content, dict):
+                yield content
+            else:
+                yield from content
+
     def get_schema(self):
         URL = '{}/schema'.format(self.base_url)
         content = self._submit(URL)
@@ -152,28 +400,9 @@ class solrWrapper(object):
         
         # Let's build query URL:
         URL = '{}/select?'.format(self.base_url) 
-        query = []
-        
-        # If there's a search term given:
-        if term:
-            query.append(term)
-        
-        # If there's keywords given:
-        if keyword_terms:
-            query += ['{}:{}'.format(key, value) for key, value in keyword_terms.items()]
-        
-        # If there's resourcename specified:
-        if resourcename:
-            query.append('resourcename:{}'.format(resourcename))
-        
-        # If something is given:
-        if query:
-            query_strig = ' AND '.join(query)
-        else:
-            query_strig = '*:*'
-            
+
         # Start building the full request:
-        fullRequest = {'q' : query_strig}
+        fullRequest = {'q' : self._build_query_string(term, keyword_terms, resourcename)}
         
         # Is the output format specified:
         if wt:
@@ -204,33 +433,174 @@ class solrWrapper(object):
         
         # Save facet counts:
         if facet:
-            resourcename = result['facet_counts']['facet_fields']['resourcename']
-            self.facets = dict(zip(resourcename[::2],resourcename[1::2]))
+            self.facets = self._parse_facets(result)
             
         # Save URL:
         self.URL = URL
         
+    def iter_docs(self, term = None, keyword_terms = None, fl = None, resourcename = None,
+                  batch_size = 10000, unique_key = 'id'):
+        '''
+        Generator yielding the matching documents in batches (lists of dictionaries).
+
+        Pages through the index with cursorMark sorted on the unique key, so only one batch is kept in
+        memory and deep pages cost the same as the first one. self.counts is set to the number of hits.
+        '''
+
+        fullRequest = {
+            'q' : self._build_query_string(term, keyword_terms, resourcename),
+            'wt' : 'json',
+            'rows' : batch_size,
+            'sort' : '{} asc'.format(unique_key)
+        }
+
+        # Are we restricting fields:
+        if fl:
+            fullRequest['fl'] = ','.join(fl)
+
+        cursorMark = '*'
+        while True:
+            fullRequest['cursorMark'] = cursorMark
+            URL = '{}/select?{}'.format(self.base_url, urllib.parse.urlencode(fullRequest))
+            result = self._submit(URL)
+
+            self.counts = result['response']['numFound']
+            if result['response']['docs']:
+                yield result['response']['docs']
+
+            # The cursor does not change when all documents are returned:
+            if result['nextCursorMark'] == cursorMark:
+                break
+            cursorMark = result['nextCursorMark']
+
+    def export(self, fl, sort = None, term = None, keyword_terms = None, resourcename = None,
+               batch_size = 10000, chunk_size = 1048576):
+        '''
+        Generator yielding all matching documents in batches, streamed from the /export handler.
+
+        The whole result set is sent by solr in one response, which is parsed while it is downloaded. All fields
+        in fl and sort must have docValues. The default sort is the first field of fl in ascending order.
+        '''
+
+        fullRequest = {
+            'q' : self._build_query_string(term, keyword_terms, resourcename),
+            'fl' : ','.join(fl),
+            'sort' : sort if sort else '{} asc'.format(fl[0])
+        }
+        URL = '{}/export?{}'.format(self.base_url, urllib.parse.urlencode(fullRequest))
+        self._check_connection()
+
+        if self.__verbose:
+            print('[Info] Submitting: {}'.format(URL))
+
+        with self.__session.get(URL, stream = True, timeout = self.__timeout) as r:
+            if not r.ok:
+                r.raise_for_status()
+
+            batch = []
+            for doc in _iter_json_array(r.iter_content(chunk_size = chunk_size), 'docs'):
+                # Errors during the export are reported as a document:
+                if 'EXCEPTION' in doc:
+                    raise Exception('[Error] Export failed: {}'.format(doc['EXCEPTION']))
+
+                batch.append(doc)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+
+            if batch:
+                yield batch
+
+    @staticmethod
+    def _build_query_string(term = None, keyword_terms = None, resourcename = None):
+        query = []
+
+        # If there's a search term given:
+        if term:
+            query.append(term)
+
+        # If there's keywords given:
+        if keyword_terms:
+            query += ['{}:{}'.format(key, value) for key, value in keyword_terms.items()]
+
+        # If there's resourcename specified:
+        if resourcename:
+            query.append('resourcename:{}'.format(resourcename))
+
+        # If something is given:
+        if query:
+            return(' AND '.join(query))
+        else:
+            return('*:*')
+
+    @staticmethod
+    def _parse_facets(result):
+        resourcename = result['facet_counts']['facet_fields']['resourcename']
+        return(dict(zip(resourcename[::2],resourcename[1::2])))
+
+    # Count queries don't modify the stored documents, so they can run concurrently on the same object:
     def get_all_document_count(self):
-        self.query(rows=1)
-        return(self.counts)
+        URL = '{}/select?{}'.format(self.base_url, urllib.parse.urlencode({'q' : '*:*', 'wt' : 'json', 'rows' : 0}))
+        counts = self._submit(URL)['response']['numFound']
+        self.counts = counts
+        return(counts)
+
+    def get_document_count(self, term = None, keyword_terms = None, resourcename = None):
+        # Number of documents matching the query (eg. documents a delete query would remove):
+        URL = '{}/select?{}'.format(self.base_url, urllib.parse.urlencode(
+            {'q' : self._build_query_string(term, keyword_terms, resourcename), 'wt' : 'json', 'rows' : 0}))
+        return(self._submit(URL)['response']['numFound'])
         
     def get_facets(self):
-        self.query(rows=1,facet=True)
-        return(self.facets)
+        URL = '{}/select?{}'.format(self.base_url, urllib.parse.urlencode(
+            {'q' : '*:*', 'wt' : 'json', 'rows' : 0, 'facet' : 'true', 'facet.field' : 'resourcename'}))
+        facets = self._parse_facets(self._submit(URL))
+        self.facets = facets
+        return(facets)
     
     def _submit(self, URL, headers={ "Content-Type" : "application/json", "Accept" : "application/json"}, jsonData = {}, data = ''):
+        # Lazy wrappers are checked before the first request:
+        self._check_connection()
+
+        # Read-only queries can be served from the cache. Admin requests and cursorMark pages are never cached.
+        # Callers get their own copy of the cached response, so modifying it doesn't change the cache:
+        cacheable = (self.__cache_size and not jsonData and not data and
+                     '/admin/' not in URL and 'cursorMark=' not in URL)
+        if cacheable:
+            with self.__cache_lock:
+                if URL in self.__cache:
+                    self.__cache_hits += 1
+                    self.__cache.move_to_end(URL)
+                    return(copy.deepcopy(self.__cache[URL]))
+                self.__cache_misses += 1
+
+        if self.__verbose:
+            print('[Info] Submitting: {}'.format(URL))
+
         if not jsonData and not data:
-            r = requests.get(URL, headers=headers, )
+            r = self.__session.get(URL, headers=headers, timeout = self.__timeout)
         elif data:
-            r = requests.post(URL, headers=headers, data = data)
+            r = self.__session.post(URL, headers=headers, data = data, timeout = self.__timeout)
         else:
-            r = requests.post(URL, headers=headers, json = jsonData)
+            r = self.__session.post(URL, headers=headers, json = jsonData, timeout = self.__timeout)
+
+        # Any update invalidates the cached responses:
+        if jsonData or data:
+            self.clear_cache()
         
         if not r.ok:
             r.raise_for_status()
 
         try:
-            return(r.json())
+            content = r.json()
         except:
             return(r.content)
 
+        if cacheable:
+            with self.__cache_lock:
+                self.__cache[URL] = copy.deepcopy(content)
+                if len(self.__cache) > self.__cache_size:
+                    self.__cache.popitem(last = False)
+
+        return(content)
+